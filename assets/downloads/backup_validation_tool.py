@@ -7,17 +7,396 @@ Created by Aria Shaw - 2025
 """
 
 import zipfile
+import zlib
 import json
-import tempfile
+import shutil
+import sqlite3
 import subprocess
+import tempfile
+import threading
 import os
 import sys
 import argparse
+import glob
+import hashlib
+import itertools
+import math
+import random
+import re
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+# Chunk size for streaming ZIP members
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Odoo stores attachments as filestore/[<db>/]<xx>/<sha1>, xx = sha1[:2]
+FILESTORE_MEMBER = re.compile(r'^filestore/(?:[^/]+/)?([0-9a-f]{2})/([0-9a-f]{40})$')
+
+# Bytes hashed from each end of an archive for the validation ledger key
+LEDGER_SAMPLE_SIZE = 1024 * 1024
+
+# Core Odoo tables counted after a restore test; the required ones must have rows
+RESTORE_SANITY_TABLES = ('res_users', 'res_company', 'ir_module_module', 'res_partner', 'ir_model',
+                         'ir_attachment', 'mail_message', 'account_move', 'sale_order', 'stock_move')
+RESTORE_REQUIRED_TABLES = ('res_users', 'res_company', 'ir_module_module')
+
+# Rough space estimate for a restore test cluster: a fresh cluster plus a
+# multiple of the dump size for the restored tables and indexes
+RESTORE_CLUSTER_BYTES = 64 * 1024 * 1024
+RESTORE_SIZE_FACTOR = 3
+
+class PgDumpTocReader:
+    """Pure-Python reader for the header and TOC of a pg_dump archive.
+
+    Follows ReadHead()/ReadToc() in PostgreSQL's pg_backup_archiver.c, so no
+    PostgreSQL client is needed. Only the header and TOC are read from the
+    stream; every byte consumed is kept in `consumed` so the caller can replay
+    it (e.g. into pg_restore) before the rest of the stream.
+    """
+
+    MIN_VERSION = (1, 7)
+    MAX_VERSION = (1, 16)
+    FORMATS = {1: 'custom', 2: 'files', 3: 'tar', 4: 'null', 5: 'directory'}
+    COMPRESSION = {0: 'none', 1: 'gzip', 2: 'lz4', 3: 'zstd'}
+    OFFSET_POS_SET = 2
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.consumed = bytearray()
+        self.version = (1, 0, 0)
+        self.int_size = 4
+        self.off_size = 8
+
+    def _read(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.stream.read(size - len(data))
+            if not chunk:
+                raise ValueError("Dump ends inside the archive header/TOC")
+            data += chunk
+        self.consumed += data
+        return data
+
+    def _byte(self):
+        return self._read(1)[0]
+
+    def _int(self):
+        # Sign byte, then intSize little-endian magnitude bytes
+        negative = self._byte() if self.version > (1, 0, 0) else 0
+        value = int.from_bytes(self._read(self.int_size), 'little')
+        return -value if negative else value
+
+    def _str(self):
+        length = self._int()
+        if length < 0:
+            return None
+        return self._read(length).decode('utf-8', errors='replace')
+
+    def _offset(self):
+        flag = self._byte()
+        return flag, int.from_bytes(self._read(self.off_size), 'little')
+
+    def read_header(self):
+        if self._read(5) != b'PGDMP':
+            raise ValueError("Not a pg_dump archive (missing PGDMP magic)")
+
+        vmaj, vmin = self._byte(), self._byte()
+        vrev = self._byte() if vmaj > 1 or (vmaj == 1 and vmin > 0) else 0
+        self.version = (vmaj, vmin, vrev)
+        if not self.MIN_VERSION <= (vmaj, vmin) <= self.MAX_VERSION:
+            raise ValueError(f"Unsupported archive version {vmaj}.{vmin}.{vrev}")
+
+        self.int_size = self._byte()
+        self.off_size = self._byte()
+        archive_format = self._byte()
+
+        if self.version >= (1, 15):
+            algorithm = self._byte()
+            compression = self.COMPRESSION.get(algorithm, f"unknown ({algorithm})")
+        else:
+            # Older archives store a zlib level; 0 means uncompressed
+            compression = 'gzip' if self._int() != 0 else 'none'
+
+        sec, minute, hour, mday, mon, year, _isdst = (self._int() for _ in range(7))
+        try:
+            created = datetime(year + 1900, mon + 1, mday, hour, minute, sec).isoformat()
+        except ValueError:
+            created = None
+        dbname = self._str()
+
+        header = {
+            'archive_version': '.'.join(map(str, self.version)),
+            'format': self.FORMATS.get(archive_format, f"unknown ({archive_format})"),
+            'compression': compression,
+            'created': created,
+            'database': dbname,
+        }
+        if self.version >= (1, 10):
+            header['server_version'] = self._str()
+            header['pg_dump_version'] = self._str()
+        return header, archive_format
+
+    def read_toc(self, archive_format):
+        entries = []
+        for _ in range(self._int()):
+            entry = {'dump_id': self._int(), 'had_dumper': bool(self._int())}
+            if self.version >= (1, 8):
+                self._str()  # table oid
+            self._str()  # oid
+            entry['tag'] = self._str()
+            entry['desc'] = self._str()
+            if self.version >= (1, 11):
+                self._int()  # section
+            self._str()  # definition
+            self._str()  # drop statement
+            self._str()  # copy statement
+            entry['namespace'] = self._str()
+            if self.version >= (1, 10):
+                self._str()  # tablespace
+            if self.version >= (1, 14):
+                self._str()  # table access method
+            if self.version >= (1, 16):
+                self._int()  # relkind
+            self._str()  # owner
+            if self.version >= (1, 9):
+                self._str()  # with oids
+            while self._str() is not None:
+                pass  # dependencies
+
+            # Format-specific extra TOC data
+            if archive_format == 1:
+                flag, offset = self._offset()
+                entry['offset'] = offset if flag == self.OFFSET_POS_SET else None
+            elif archive_format in (3, 5):
+                self._str()  # data file name
+            entries.append(entry)
+        return entries
+
+    def read(self, archive_size=None):
+        """Parse header and TOC and summarise them for the validation report.
+
+        Table data sizes are the distance between consecutive data offsets
+        (the last block runs to `archive_size`); they are the on-disk,
+        possibly compressed, sizes. Offsets are missing when pg_dump wrote
+        to a pipe, in which case sizes are None.
+        """
+        started = time.perf_counter()
+        header, archive_format = self.read_header()
+        entries = self.read_toc(archive_format)
+
+        positioned = sorted(e['offset'] for e in entries if e.get('offset') is not None)
+        next_offset = dict(zip(positioned, positioned[1:] + [archive_size]))
+        tables = []
+        for entry in entries:
+            if entry['desc'] != 'TABLE DATA':
+                continue
+            offset = entry.get('offset')
+            end = next_offset.get(offset) if offset is not None else None
+            tables.append({
+                'table': f"{entry['namespace']}.{entry['tag']}" if entry['namespace'] else entry['tag'],
+                'offset': offset,
+                'size_bytes': end - offset if end is not None else None,
+            })
+        tables.sort(key=lambda t: t['size_bytes'] or 0, reverse=True)
+
+        header.update({
+            'toc_entries': len(entries),
+            'toc_bytes': len(self.consumed),
+            'object_counts': dict(Counter(e['desc'] for e in entries).most_common()),
+            'table_data_count': len(tables),
+            'offsets_available': bool(positioned),
+            'tables': tables,
+            'parse_ms': round((time.perf_counter() - started) * 1000, 2),
+        })
+        return header
+
+class ScratchCluster:
+    """Throwaway PostgreSQL cluster in a scratch directory, removed on exit.
+
+    The server listens only on a Unix socket inside the scratch directory
+    and runs with durability off, since its data is discarded anyway.
+    """
+
+    def __init__(self, base_dir=None, pg_bin=None):
+        self.base_dir = base_dir
+        self.pg_bin = pg_bin
+        self.root = None
+        self.started = False
+
+    def tool(self, name):
+        path = os.path.join(self.pg_bin, name) if self.pg_bin else shutil.which(name)
+        if not path or not os.access(path, os.X_OK):
+            raise RuntimeError(f"{name} not found; install the PostgreSQL server binaries or pass --pg-bin")
+        return path
+
+    def __enter__(self):
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            raise RuntimeError("initdb refuses to run as root; run the restore test as an unprivileged user")
+        initdb, pg_ctl = self.tool('initdb'), self.tool('pg_ctl')
+        self.root = tempfile.mkdtemp(prefix='odoo-restore-test-', dir=self.base_dir)
+        try:
+            data_dir = os.path.join(self.root, 'data')
+            subprocess.run([initdb, '-D', data_dir, '-U', 'postgres', '-A', 'trust', '-E', 'UTF8', '--no-sync'],
+                           check=True, capture_output=True)
+            options = (f"-k {self.root} -c listen_addresses='' -c fsync=off "
+                       "-c full_page_writes=off -c synchronous_commit=off")
+            subprocess.run([pg_ctl, '-D', data_dir, '-o', options, '-l', os.path.join(self.root, 'server.log'),
+                            '-w', 'start'], check=True, capture_output=True)
+            self.started = True
+        except BaseException:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.started:
+            subprocess.run([self.tool('pg_ctl'), '-D', os.path.join(self.root, 'data'), '-m', 'immediate',
+                            'stop'], capture_output=True)
+            self.started = False
+        if self.root:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
+
+    def connection_args(self, dbname):
+        return ['-h', self.root, '-U', 'postgres', '-d', dbname]
+
+    def createdb(self, dbname):
+        subprocess.run([self.tool('createdb'), '-h', self.root, '-U', 'postgres', dbname],
+                       check=True, capture_output=True)
+
+    def psql(self, dbname, sql):
+        result = subprocess.run([self.tool('psql'), '-X', '-A', '-t', '-F', '|', '-v', 'ON_ERROR_STOP=1',
+                                 '-c', sql] + self.connection_args(dbname),
+                                check=True, capture_output=True, text=True)
+        return [line.split('|') for line in result.stdout.splitlines() if line]
+
+    def restore_custom(self, dbname, dump_path, jobs):
+        """Run pg_restore -j and time every item from its verbose log.
+
+        In the parallel phase items are timed from "launching item" to
+        "finished item"; items restored serially run until the next log line.
+        Returns (returncode, {item label: seconds}, [error lines]).
+        """
+        process = subprocess.Popen([self.tool('pg_restore'), '--verbose', '--no-owner', '--no-privileges',
+                                    '-j', str(jobs)] + self.connection_args(dbname) + [dump_path],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        timings, launched, errors = {}, {}, []
+        parallel, current = False, None
+        for line in process.stderr:
+            now = time.monotonic()
+            message = line.rstrip('\n')
+            if message.startswith('pg_restore: '):
+                message = message[len('pg_restore: '):]
+            if current:
+                timings[current[0]] = now - current[1]
+                current = None
+
+            if message.startswith('entering main parallel loop'):
+                parallel = True
+            elif message.startswith('finished main parallel loop'):
+                parallel = False
+            elif message.startswith(('launching item ', 'finished item ')):
+                action, _, item_id, label = message.split(' ', 3)
+                if action == 'launching':
+                    launched[item_id] = now
+                else:
+                    timings[label] = now - launched.pop(item_id, now)
+            elif not parallel and message.startswith('processing data for table '):
+                current = ('TABLE DATA ' + message.split('"')[1].split('.')[-1], now)
+            elif not parallel and message.startswith('creating '):
+                # 'creating INDEX "public.name"' -> 'INDEX name', as in the parallel log
+                desc, _, name = message[len('creating '):].partition(' "')
+                name = name.rstrip('"').split('.', 1)[-1]
+                current = (f"{desc} {name}", now)
+            elif message.startswith('error: '):
+                errors.append(message[len('error: '):])
+        return process.wait(), timings, errors
+
+    def restore_plain(self, dbname, stream):
+        """Stream a plain SQL dump into psql; returns (returncode, [error lines])"""
+        log_path = os.path.join(self.root, 'psql.log')
+        with open(log_path, 'w') as log:
+            process = subprocess.Popen([self.tool('psql'), '-X', '-q'] + self.connection_args(dbname),
+                                       stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=log)
+            try:
+                shutil.copyfileobj(stream, process.stdin, STREAM_CHUNK_SIZE)
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            returncode = process.wait()
+        with open(log_path) as log:
+            errors = [line.strip() for line in log if 'ERROR:' in line]
+        return returncode, errors
+
+class ValidationLedger:
+    """SQLite ledger of validation results keyed by archive fingerprint.
+
+    A stored result is reused while the archive's size, mtime and head/tail
+    hash are unchanged and it was produced with the same check options.
+    Only passing results are kept: a failure may come from the environment
+    (no pg_restore, a timeout) rather than the archive, so it is always
+    re-checked, and so is a requested restore test that was skipped. With `max_age` (seconds), older results are treated as
+    missing so every archive is still re-read periodically.
+    """
+
+    def __init__(self, ledger_path, max_age=None):
+        self.max_age = max_age
+        self.conn = sqlite3.connect(ledger_path, timeout=30)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS validations ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, quick_hash TEXT, "
+            "options TEXT, validated_at REAL, result TEXT)")
+        self.conn.commit()
+
+    def lookup(self, backup_path, fingerprint, options):
+        row = self.conn.execute(
+            "SELECT validated_at, result FROM validations WHERE path = ? AND size = ? AND mtime_ns = ? "
+            "AND quick_hash = ? AND options = ?",
+            (os.path.abspath(backup_path), fingerprint['size'], fingerprint['mtime_ns'],
+             fingerprint['quick_hash'], json.dumps(options, sort_keys=True))).fetchone()
+        if row is None or (self.max_age is not None and time.time() - row[0] > self.max_age):
+            return None
+        result = json.loads(row[1])
+        return result if result.get('validation_passed') else None
+
+    def record(self, backup_path, fingerprint, options, result):
+        restore_skipped = options.get('restore_test') and 'restore_test' not in result['validation_results']
+        if not result.get('validation_passed') or restore_skipped:
+            self.conn.execute("DELETE FROM validations WHERE path = ?", (os.path.abspath(backup_path),))
+            self.conn.commit()
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO validations VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(backup_path), fingerprint['size'], fingerprint['mtime_ns'],
+             fingerprint['quick_hash'], json.dumps(options, sort_keys=True), time.time(), json.dumps(result)))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
 class OdooBackupValidator:
-    def __init__(self, backup_path):
+    def __init__(self, backup_path, verify_filestore=None, verify_workers=None, verify_budget=None,
+                 restore_test=False, restore_jobs=None, restore_dir=None, pg_bin=None):
         self.backup_path = backup_path
+        # Fraction of filestore members to checksum (1.0 = all), None = off
+        self.verify_filestore = verify_filestore
+        self.verify_workers = verify_workers or min(8, os.cpu_count() or 1)
+        self.verify_budget = verify_budget
+        self.restore_test = restore_test
+        self.restore_jobs = restore_jobs or min(4, os.cpu_count() or 1)
+        # None = /dev/shm when the restored database fits there, else TMPDIR
+        self.restore_dir = restore_dir
+        self.pg_bin = pg_bin
+        # Options that change which checks run; part of the ledger key
+        self.check_options = {'verify_filestore': verify_filestore, 'restore_test': bool(restore_test)}
+        self.checks = []
+        self.cached = False
+        self.validated_at = None
+        # Wall time and bytes per check for this run; never taken from the ledger
+        self.timings = {}
+        self.total_seconds = 0.0
         self.validation_results = {
             'zip_integrity': False,
             'manifest_valid': False,
@@ -27,6 +406,10 @@ class OdooBackupValidator:
             'version_compatible': False,
             'timestamp_recent': False
         }
+        if verify_filestore:
+            self.validation_results['filestore_checksums'] = False
+        if restore_test:
+            self.validation_results['restore_test'] = False
         self.details = {}
 
     def validate_zip_integrity(self):
@@ -58,40 +441,39 @@ class OdooBackupValidator:
                     self.details['manifest_error'] = "manifest.json not found in backup"
                     return False
 
-                # Read and parse manifest
-                manifest_data = zip_ref.read('manifest.json')
-                manifest = json.loads(manifest_data)
-
-                # Check required fields
-                required_fields = ['odoo_version', 'timestamp', 'version_info']
-                for field in required_fields:
-                    if field not in manifest:
-                        self.details['manifest_error'] = f"Missing required field: {field}"
-                        return False
-
-                self.validation_results['manifest_valid'] = True
-                self.details['odoo_version'] = manifest.get('odoo_version', 'unknown')
-                self.details['backup_timestamp'] = manifest.get('timestamp', 'unknown')
-
-                # Check version compatibility (basic check)
-                version_info = manifest.get('version_info', [])
-                if isinstance(version_info, list) and len(version_info) >= 2:
-                    major_version = version_info[0]
-                    if major_version >= 13:  # Support versions 13+
-                        self.validation_results['version_compatible'] = True
-                    self.details['major_version'] = major_version
-
-                # Check timestamp recency (within last 7 days is reasonable)
-                try:
-                    backup_time = datetime.fromisoformat(manifest.get('timestamp', '').replace('Z', '+00:00'))
-                    age_days = (datetime.now() - backup_time.replace(tzinfo=None)).days
-                    if age_days <= 7:
-                        self.validation_results['timestamp_recent'] = True
-                    self.details['backup_age_days'] = age_days
-                except:
-                    self.details['timestamp_error'] = "Could not parse backup timestamp"
+                return self._check_manifest(zip_ref.read('manifest.json'))
 
-                return True
+        except Exception as e:
+            self.details['manifest_error'] = str(e)
+            return False
+
+    def _check_manifest(self, manifest_data):
+        """Validate the contents of manifest.json"""
+        try:
+            # Read and parse manifest
+            manifest = json.loads(manifest_data)
+
+            # Check required fields
+            required_fields = ['odoo_version', 'timestamp', 'version_info']
+            for field in required_fields:
+                if field not in manifest:
+                    self.details['manifest_error'] = f"Missing required field: {field}"
+                    return False
+
+            self.validation_results['manifest_valid'] = True
+            self.details['odoo_version'] = manifest.get('odoo_version', 'unknown')
+            self.details['backup_timestamp'] = manifest.get('timestamp', 'unknown')
+
+            # Check version compatibility (basic check)
+            version_info = manifest.get('version_info', [])
+            if isinstance(version_info, list) and len(version_info) >= 2:
+                major_version = version_info[0]
+                if major_version >= 13:  # Support versions 13+
+                    self.validation_results['version_compatible'] = True
+                self.details['major_version'] = major_version
+
+            self._check_backup_age(manifest.get('timestamp', ''))
+            return True
 
         except json.JSONDecodeError:
             self.details['manifest_error'] = "Invalid JSON format in manifest"
@@ -100,98 +482,457 @@ class OdooBackupValidator:
             self.details['manifest_error'] = str(e)
             return False
 
+    def _check_backup_age(self, timestamp):
+        # Check timestamp recency (within last 7 days is reasonable)
+        try:
+            backup_time = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+            age_days = (datetime.now() - backup_time.replace(tzinfo=None)).days
+            self.validation_results['timestamp_recent'] = age_days <= 7
+            self.details['backup_age_days'] = age_days
+        except:
+            self.details['timestamp_error'] = "Could not parse backup timestamp"
+
     def validate_database_dump(self):
         """Validate PostgreSQL database dump"""
         try:
             with zipfile.ZipFile(self.backup_path, 'r') as zip_ref:
                 # Look for database dump file
-                dump_file = None
-                for filename in zip_ref.namelist():
-                    if filename.endswith(('.sql', '.dump', '.backup')):
-                        dump_file = filename
-                        break
+                dump_file = self._find_dump_file(zip_ref.namelist())
 
                 if not dump_file:
                     self.details['database_error'] = "No database dump file found"
                     return False
 
-                # Extract and validate dump
-                with tempfile.NamedTemporaryFile(suffix='.sql', delete=False) as temp_file:
-                    temp_file.write(zip_ref.read(dump_file))
-                    temp_file.flush()
-                    temp_path = temp_file.name
+                with zip_ref.open(dump_file) as stream:
+                    return self._check_dump(dump_file, stream, zip_ref.getinfo(dump_file).file_size)
 
-                try:
-                    # Check file size
-                    dump_size = os.path.getsize(temp_path)
-                    self.details['dump_size_mb'] = dump_size / (1024 * 1024)
-
-                    # Try to validate with pg_restore if available
-                    if dump_file.endswith(('.dump', '.backup')):
-                        result = subprocess.run([
-                            'pg_restore', '--list', temp_path
-                        ], capture_output=True, text=True, timeout=30)
-
-                        if result.returncode == 0:
-                            self.validation_results['database_valid'] = True
-                            # Count tables/objects
-                            table_count = result.stdout.count('TABLE DATA')
-                            self.details['table_count'] = table_count
-                        else:
-                            self.details['database_error'] = f"pg_restore validation failed: {result.stderr}"
+        except Exception as e:
+            self.details['database_error'] = str(e)
+            return False
 
-                    # For SQL files, do basic validation
-                    elif dump_file.endswith('.sql'):
-                        with open(temp_path, 'r', encoding='utf-8', errors='ignore') as f:
-                            first_lines = f.read(1024)
-                            if 'PostgreSQL database dump' in first_lines or 'CREATE TABLE' in first_lines:
-                                self.validation_results['database_valid'] = True
-                            else:
-                                self.details['database_error'] = "SQL file doesn't appear to be a valid PostgreSQL dump"
+    def _find_dump_file(self, names):
+        for filename in names:
+            if filename.endswith(('.sql', '.dump', '.backup')):
+                return filename
+        return None
 
-                    return self.validation_results['database_valid']
+    def _check_dump(self, dump_file, stream, dump_size):
+        """Validate a dump streamed from the archive; the stream is always read to the end"""
+        try:
+            # Check file size
+            self.details['dump_size_mb'] = dump_size / (1024 * 1024)
 
-                finally:
-                    # Cleanup temp file
-                    try:
-                        os.unlink(temp_path)
-                    except:
+            # Parse the archive header and TOC natively, then replay the
+            # consumed bytes ahead of the rest of the stream
+            if dump_file.endswith(('.dump', '.backup')):
+                toc_reader = PgDumpTocReader(stream)
+                try:
+                    toc = toc_reader.read(dump_size)
+                except ValueError as e:
+                    toc = None
+                    self.details['dump_toc_error'] = str(e)
+                else:
+                    self.details['dump_toc'] = toc
+                    self.details['table_count'] = toc['table_data_count']
+                chunks = itertools.chain([bytes(toc_reader.consumed)],
+                                         iter(lambda: stream.read(STREAM_CHUNK_SIZE), b''))
+
+                if not shutil.which('pg_restore'):
+                    for _ in chunks:
                         pass
+                    if toc is not None:
+                        self.validation_results['database_valid'] = True
+                    else:
+                        self.details['database_error'] = "pg_restore not found and dump TOC could not be parsed"
+                    return self.validation_results['database_valid']
+
+                returncode, stdout, stderr = self._pg_restore_list(chunks)
+                if returncode == 0:
+                    self.validation_results['database_valid'] = True
+                    if toc is None:
+                        # Count tables/objects
+                        self.details['table_count'] = stdout.count('TABLE DATA')
+                else:
+                    self.details['database_error'] = f"pg_restore validation failed: {stderr}"
+
+            # For SQL files, do basic validation
+            elif dump_file.endswith('.sql'):
+                first_lines = stream.read(1024).decode('utf-8', errors='ignore')
+                if 'PostgreSQL database dump' in first_lines or 'CREATE TABLE' in first_lines:
+                    self.validation_results['database_valid'] = True
+                else:
+                    self.details['database_error'] = "SQL file doesn't appear to be a valid PostgreSQL dump"
+                _drain(stream)
+
+            return self.validation_results['database_valid']
 
         except subprocess.TimeoutExpired:
             self.details['database_error'] = "Database validation timed out"
             return False
+        except (zipfile.BadZipFile, zlib.error, EOFError):
+            # Corrupted member data is reported by the ZIP integrity check
+            self.details['database_error'] = "Database dump is corrupted in the archive"
+            raise
         except Exception as e:
             self.details['database_error'] = str(e)
             return False
 
+    def _pg_restore_list(self, chunks):
+        """Pipe dump chunks into `pg_restore --list` on stdin, with no temp file.
+
+        pg_restore only needs the header and TOC and may close stdin early;
+        the remaining chunks are still consumed so the member's CRC gets verified.
+        """
+        process = subprocess.Popen(['pg_restore', '--list'], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output = {}
+
+        def collect(name, pipe):
+            output[name] = pipe.read()
+
+        readers = [threading.Thread(target=collect, args=(name, pipe), daemon=True)
+                   for name, pipe in (('stdout', process.stdout), ('stderr', process.stderr))]
+        for reader in readers:
+            reader.start()
+
+        try:
+            feeding = True
+            for chunk in chunks:
+                if feeding:
+                    try:
+                        process.stdin.write(chunk)
+                    except BrokenPipeError:
+                        feeding = False
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            returncode = process.wait(timeout=30)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            for reader in readers:
+                reader.join()
+
+        return (returncode, output.get('stdout', b'').decode('utf-8', errors='replace'),
+                output.get('stderr', b'').decode('utf-8', errors='replace'))
+
     def validate_filestore(self):
         """Check for filestore presence and basic structure"""
         try:
             with zipfile.ZipFile(self.backup_path, 'r') as zip_ref:
-                filestore_files = [f for f in zip_ref.namelist() if f.startswith('filestore/')]
+                return self._check_filestore(zip_ref.namelist())
 
-                if filestore_files:
-                    self.validation_results['filestore_present'] = True
-                    self.details['filestore_file_count'] = len(filestore_files)
+        except Exception as e:
+            self.details['filestore_error'] = str(e)
+            return False
+
+    def _check_filestore(self, names):
+        """Check filestore presence and structure from the archive's member names"""
+        filestore_files = [f for f in names if f.startswith('filestore/')]
+
+        if filestore_files:
+            self.validation_results['filestore_present'] = True
+            self.details['filestore_file_count'] = len(filestore_files)
 
-                    # Check for reasonable directory structure
-                    directories = set()
-                    for f in filestore_files:
-                        parts = f.split('/')
-                        if len(parts) >= 3:  # filestore/db_name/xx/
-                            directories.add('/'.join(parts[:3]))
+            # Check for reasonable directory structure
+            directories = set()
+            for f in filestore_files:
+                parts = f.split('/')
+                if len(parts) >= 3:  # filestore/db_name/xx/
+                    directories.add('/'.join(parts[:3]))
+
+            self.details['filestore_directories'] = len(directories)
+            return True
+        else:
+            self.details['filestore_note'] = "No filestore found (database-only backup)"
+            return False
 
-                    self.details['filestore_directories'] = len(directories)
-                    return True
+    def scan_archive(self):
+        """Run the ZIP, manifest, dump and filestore checks in a single pass.
+
+        The central directory is read once and every member is decompressed
+        exactly once, which verifies its CRC; the manifest and dump checks
+        run on their members as they stream past. Returns a dict mapping
+        each check to its outcome.
+        """
+        outcome = {'zip': False, 'manifest': False, 'database': False, 'filestore': False,
+                   'filestore_checksums': False}
+        try:
+            opened = time.perf_counter()
+            with zipfile.ZipFile(self.backup_path, 'r') as zip_ref:
+                infos = zip_ref.infolist()
+                self._record_timing('zip_integrity', time.perf_counter() - opened,
+                                    os.path.getsize(self.backup_path) - zip_ref.start_dir)
+                names = [info.filename for info in infos]
+                self.details['zip_files'] = len(names)
+                dump_file = self._find_dump_file(names)
+                manifest_data = None
+                bad_file = None
+
+                # Sampled filestore members are hashed on a thread pool while
+                # the main thread keeps streaming the other members
+                verify = self._filestore_sample(infos) if self.verify_filestore else set()
+                executor = ThreadPoolExecutor(max_workers=self.verify_workers) if verify else None
+                window = self.verify_workers * 4
+                pending = deque()
+                verify_stats = {'verified': 0, 'mismatches': [], 'over_budget': 0}
+                deadline = (time.monotonic() + self.verify_budget) if self.verify_budget else None
+                verify_started, verify_bytes = None, [0, 0]
+
+                try:
+                    for info in infos:
+                        if info.filename in verify:
+                            if deadline is None or time.monotonic() < deadline:
+                                verify_started = verify_started or time.perf_counter()
+                                verify_bytes[0] += info.compress_size
+                                verify_bytes[1] += info.file_size
+                                pending.append((info, executor.submit(self._hash_member, zip_ref, info)))
+                                while len(pending) >= window:
+                                    bad_file = self._collect_checksum(*pending.popleft(), verify_stats) or bad_file
+                                continue
+                            verify_stats['over_budget'] += 1
+                        member_started = time.perf_counter()
+                        try:
+                            with zip_ref.open(info) as member:
+                                if info.filename == 'manifest.json':
+                                    manifest_data = member.read()
+                                elif info.filename == dump_file:
+                                    outcome['database'] = self._check_dump(dump_file, member, info.file_size)
+                                else:
+                                    _drain(member)
+                        except (zipfile.BadZipFile, zlib.error, EOFError):
+                            bad_file = bad_file or info.filename
+                        # Attribute each member's read time to the check it feeds
+                        if info.filename == 'manifest.json':
+                            check = 'manifest'
+                        elif info.filename == dump_file:
+                            check = 'database'
+                        elif info.filename.startswith('filestore/'):
+                            check = 'filestore'
+                        else:
+                            check = 'zip_integrity'
+                        self._record_timing(check, time.perf_counter() - member_started,
+                                            info.compress_size, info.file_size)
+                    while pending:
+                        bad_file = self._collect_checksum(*pending.popleft(), verify_stats) or bad_file
+                    if verify_started:
+                        self._record_timing('filestore_checksums', time.perf_counter() - verify_started,
+                                            *verify_bytes)
+                finally:
+                    if executor:
+                        executor.shutdown(cancel_futures=True)
+
+                if bad_file:
+                    self.details['zip_error'] = f"Corrupted file in ZIP: {bad_file}"
                 else:
-                    self.details['filestore_note'] = "No filestore found (database-only backup)"
-                    return False
+                    self.validation_results['zip_integrity'] = outcome['zip'] = True
+
+                if manifest_data is not None:
+                    outcome['manifest'] = self._check_manifest(manifest_data)
+                elif 'manifest.json' not in names:
+                    self.details['manifest_error'] = "manifest.json not found in backup"
+
+                if not dump_file:
+                    self.details['database_error'] = "No database dump file found"
 
+                outcome['filestore'] = self._check_filestore(names)
+                if self.verify_filestore:
+                    outcome['filestore_checksums'] = self._report_checksums(len(verify), verify_stats)
+
+        except zipfile.BadZipFile:
+            self.details['zip_error'] = "Invalid ZIP file format"
         except Exception as e:
-            self.details['filestore_error'] = str(e)
+            self.details['zip_error'] = str(e)
+
+        return outcome
+
+    def _record_timing(self, check, seconds, bytes_read=0, bytes_processed=0):
+        """Add wall time, bytes read from disk and uncompressed bytes to a check"""
+        timing = self.timings.setdefault(check, {'seconds': 0.0, 'bytes_read': 0, 'bytes_processed': 0})
+        timing['seconds'] += seconds
+        timing['bytes_read'] += bytes_read
+        timing['bytes_processed'] += bytes_processed
+
+    def performance(self):
+        """Per-check wall time, bytes and throughput for this run"""
+        checks = {}
+        for check, timing in self.timings.items():
+            seconds = timing['seconds']
+            checks[check] = {
+                'seconds': round(seconds, 4),
+                'bytes_read': timing['bytes_read'],
+                'bytes_processed': timing['bytes_processed'],
+                'throughput_mb_s': (round(timing['bytes_processed'] / seconds / (1024 * 1024), 2)
+                                    if seconds and timing['bytes_processed'] else None)
+            }
+        return {
+            'total_seconds': round(self.total_seconds, 4),
+            'bytes_read': sum(timing['bytes_read'] for timing in self.timings.values()),
+            'checks': checks
+        }
+
+    def _filestore_sample(self, infos):
+        """Names of the content-addressed filestore members to checksum"""
+        candidates = [info.filename for info in infos if FILESTORE_MEMBER.match(info.filename)]
+        self.details['filestore_verify_candidates'] = len(candidates)
+        if self.verify_filestore >= 1:
+            return set(candidates)
+        count = min(len(candidates), math.ceil(len(candidates) * self.verify_filestore))
+        return set(random.sample(candidates, count))
+
+    def _hash_member(self, zip_ref, info):
+        """Stream one member through SHA-1; runs on the verification pool"""
+        digest = hashlib.sha1()
+        with zip_ref.open(info) as member:
+            for chunk in iter(lambda: member.read(STREAM_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _collect_checksum(self, info, future, stats):
+        """Compare a hashed member with its name; returns the name if it is corrupt in the ZIP"""
+        try:
+            digest = future.result()
+        except (zipfile.BadZipFile, zlib.error, EOFError):
+            stats['mismatches'].append(f"{info.filename} (unreadable)")
+            return info.filename
+        stats['verified'] += 1
+        if digest != FILESTORE_MEMBER.match(info.filename).group(2):
+            stats['mismatches'].append(info.filename)
+        return None
+
+    def _report_checksums(self, selected, stats):
+        verified, mismatches = stats['verified'], stats['mismatches']
+        mode = 'all' if self.verify_filestore >= 1 else f"sample={self.verify_filestore * 100:g}%"
+        self.details['filestore_verify_mode'] = mode
+        self.details['filestore_verified'] = verified
+        if stats['over_budget']:
+            self.details['filestore_verify_warning'] = (
+                f"Time budget of {self.verify_budget}s reached; "
+                f"{stats['over_budget']} of {selected} selected files were not checksummed")
+        if mismatches:
+            self.details['filestore_checksum_error'] = (
+                f"{len(mismatches)} file(s) do not match their SHA-1 name: {', '.join(mismatches[:10])}")
+            return False
+        if verified:
+            # Rule of three: with no failures in n draws, the failure rate
+            # is below 3/n at 95% confidence
+            if verified < self.details['filestore_verify_candidates']:
+                self.details['filestore_verify_confidence'] = (
+                    f"< {min(1.0, 3 / verified) * 100:.2g}% of attachments corrupt (95% confidence)")
+            self.validation_results['filestore_checksums'] = True
+        elif not stats['over_budget']:
+            self.details['filestore_verify_warning'] = "No content-addressed filestore files to verify"
+        return self.validation_results['filestore_checksums']
+
+    def _restore_locations(self, dump_size, extract):
+        """Pick directories for the scratch cluster and the extracted dump.
+
+        Returns (cluster dir, extract dir, shortfall message or None). The
+        dump is always extracted to disk (TMPDIR); without --restore-dir the
+        cluster uses /dev/shm only when the restored database should fit.
+        """
+        extract_dir = tempfile.gettempdir()
+        cluster_size = RESTORE_CLUSTER_BYTES + dump_size * RESTORE_SIZE_FACTOR
+        cluster_dir = self.restore_dir
+        if cluster_dir is None:
+            fits = os.access('/dev/shm', os.W_OK) and shutil.disk_usage('/dev/shm').free >= cluster_size
+            cluster_dir = '/dev/shm' if fits else extract_dir
+
+        needed = {}
+        for path, size in ((cluster_dir, cluster_size), (extract_dir, dump_size if extract else 0)):
+            device = os.stat(path).st_dev
+            needed[device] = (path, needed.get(device, (path, 0))[1] + size)
+        for path, size in needed.values():
+            free = shutil.disk_usage(path).free
+            if free < size:
+                return cluster_dir, extract_dir, (f"needs about {size / (1024 * 1024):.0f} MB in {path}, "
+                                                  f"only {free / (1024 * 1024):.0f} MB free")
+        return cluster_dir, extract_dir, None
+
+    def run_restore_test(self):
+        """Restore the dump into a throwaway cluster and sanity-check core tables.
+
+        Custom-format dumps are extracted to a disk scratch directory so that
+        pg_restore can run with -j; plain SQL dumps are streamed into psql.
+        Per-item restore times are kept to show which tables dominate RTO.
+        Returns None if there is not enough free space to run the test.
+        """
+        dbname = 'odoo_restore_test'
+        started = time.perf_counter()
+        report = {'jobs': self.restore_jobs}
+        try:
+            with zipfile.ZipFile(self.backup_path, 'r') as zip_ref:
+                dump_file = self._find_dump_file(zip_ref.namelist())
+                if not dump_file:
+                    self.details['restore_error'] = "No database dump file found"
+                    return False
+
+                extract = not dump_file.endswith('.sql')
+                cluster_dir, extract_dir, shortfall = self._restore_locations(
+                    zip_ref.getinfo(dump_file).file_size, extract)
+                if shortfall:
+                    self.details['restore_warning'] = f"Skipped: restore test {shortfall}"
+                    del self.validation_results['restore_test']
+                    return None
+
+                with ScratchCluster(cluster_dir, self.pg_bin) as cluster, \
+                        tempfile.TemporaryDirectory(prefix='odoo-restore-dump-', dir=extract_dir) as scratch:
+                    cluster.createdb(dbname)
+                    restore_started = time.perf_counter()
+                    if dump_file.endswith('.sql'):
+                        with zip_ref.open(dump_file) as stream:
+                            returncode, errors = cluster.restore_plain(dbname, stream)
+                        timings = {}
+                    else:
+                        dump_path = os.path.join(scratch, 'restore.dump')
+                        with zip_ref.open(dump_file) as stream, open(dump_path, 'wb') as f:
+                            shutil.copyfileobj(stream, f, STREAM_CHUNK_SIZE)
+                        report['extract_seconds'] = round(time.perf_counter() - restore_started, 3)
+                        restore_started = time.perf_counter()
+                        returncode, timings, errors = cluster.restore_custom(dbname, dump_path, self.restore_jobs)
+                    report['restore_seconds'] = round(time.perf_counter() - restore_started, 3)
+
+                    names = "', '".join(RESTORE_SANITY_TABLES)
+                    existing = [row[0] for row in cluster.psql(dbname, (
+                        "SELECT relname FROM pg_class WHERE relkind IN ('r', 'p') "
+                        f"AND relnamespace = 'public'::regnamespace AND relname IN ('{names}')"))]
+                    counts = {}
+                    if existing:
+                        query = ' UNION ALL '.join(f"SELECT '{t}', count(*) FROM public.{t}" for t in existing)
+                        counts = {name: int(count) for name, count in cluster.psql(dbname, query)}
+
+        except subprocess.CalledProcessError as e:
+            stderr = e.stderr.decode('utf-8', errors='replace') if isinstance(e.stderr, bytes) else e.stderr
+            self.details['restore_error'] = f"{os.path.basename(e.cmd[0])} failed: {(stderr or '').strip()}"
+            return False
+        except (RuntimeError, OSError, zipfile.BadZipFile, zlib.error) as e:
+            self.details['restore_error'] = str(e)
             return False
 
+        items = sorted(timings.items(), key=lambda item: item[1], reverse=True)
+        report.update({
+            'total_seconds': round(time.perf_counter() - started, 3),
+            'returncode': returncode,
+            'errors': len(errors),
+            'table_seconds': {label[len('TABLE DATA '):]: round(seconds, 3)
+                              for label, seconds in items if label.startswith('TABLE DATA ')},
+            'slowest_items': [{'item': label, 'seconds': round(seconds, 3)} for label, seconds in items[:10]],
+            'row_counts': counts
+        })
+        self.details['restore_test'] = report
+
+        if errors:
+            self.details['restore_warning'] = f"{len(errors)} error(s) during restore, first: {errors[0]}"
+        empty = [t for t in RESTORE_REQUIRED_TABLES if not counts.get(t)]
+        if empty:
+            self.details['restore_error'] = f"Core tables missing or empty after restore: {', '.join(empty)}"
+            return False
+        self.validation_results['restore_test'] = True
+        return True
+
     def validate_size(self):
         """Check if backup size is reasonable"""
         try:
@@ -211,38 +952,131 @@ class OdooBackupValidator:
             self.details['size_error'] = str(e)
             return False
 
-    def run_full_validation(self):
-        """Run all validation checks"""
-        print(f"🔍 Validating backup: {os.path.basename(self.backup_path)}")
-        print("=" * 60)
+    def run_checks(self, ledger=None):
+        """Run all validation checks without printing.
 
-        # Check if file exists
+        Returns a list of (check name, passed) pairs, or None if the backup
+        file does not exist. With a ValidationLedger, an unchanged archive
+        reuses its recorded result and new results are recorded.
+        """
         if not os.path.exists(self.backup_path):
-            print(f"❌ ERROR: Backup file not found: {self.backup_path}")
-            return False
+            self.details['file_error'] = f"Backup file not found: {self.backup_path}"
+            return None
+
+        started = time.perf_counter()
+        if ledger:
+            fingerprint = archive_fingerprint(self.backup_path)
+            self._record_timing('ledger', time.perf_counter() - started,
+                                min(fingerprint['size'], 2 * LEDGER_SAMPLE_SIZE))
+            cached = ledger.lookup(self.backup_path, fingerprint, self.check_options)
+            if cached:
+                self.load_result(cached)
+                self.total_seconds = time.perf_counter() - started
+                return self.checks
 
-        # Run all validation steps
+        # Run the archive checks in one streaming pass, then the size check
+        outcome = self.scan_archive()
+        check_started = time.perf_counter()
+        size_ok = self.validate_size()
+        self._record_timing('size', time.perf_counter() - check_started)
         validations = [
-            ("ZIP Integrity", self.validate_zip_integrity),
-            ("Manifest", self.validate_manifest),
-            ("Database Dump", self.validate_database_dump),
-            ("Filestore", self.validate_filestore),
-            ("File Size", self.validate_size)
+            ("ZIP Integrity", outcome['zip']),
+            ("Manifest", outcome['manifest']),
+            ("Database Dump", outcome['database']),
+            ("Filestore", outcome['filestore']),
+            ("File Size", size_ok)
         ]
+        if self.verify_filestore:
+            validations.insert(4, ("Filestore Data", outcome['filestore_checksums']))
+        if self.restore_test:
+            if outcome['database']:
+                check_started = time.perf_counter()
+                restored = self.run_restore_test()
+                self._record_timing('restore_test', time.perf_counter() - check_started,
+                                    0, int(self.details.get('dump_size_mb', 0) * 1024 * 1024))
+                if restored is not None:
+                    validations.append(("Restore Test", restored))
+            else:
+                self.details['restore_error'] = "Skipped: database dump failed validation"
+                validations.append(("Restore Test", False))
+        self.checks = validations
+        self.total_seconds = time.perf_counter() - started
 
-        for name, validator in validations:
-            try:
-                result = validator()
-                status = "✅ PASS" if result else "❌ FAIL"
-                print(f"{name:15}: {status}")
-            except Exception as e:
-                print(f"{name:15}: ❌ ERROR - {str(e)}")
+        if ledger:
+            ledger.record(self.backup_path, fingerprint, self.check_options, self.as_dict())
+        return validations
+
+    def load_result(self, result):
+        """Adopt a recorded result; backup age is re-evaluated against today"""
+        self.validation_results = dict(result['validation_results'])
+        self.details = dict(result['details'])
+        self.checks = [(check['name'], check['passed']) for check in result['checks']]
+        self.cached = True
+        self.validated_at = result['timestamp']
+        if 'backup_age_days' in self.details:
+            self._check_backup_age(self.details.get('backup_timestamp', ''))
+
+    def health_percentage(self):
+        passed_checks = sum(self.validation_results.values())
+        return (passed_checks / len(self.validation_results)) * 100
+
+    def blocking_failures(self):
+        """Names of requested checks whose failure fails validation whatever the health score"""
+        failures = []
+        if 'filestore_checksum_error' in self.details:
+            failures.append("Filestore Data")
+        if self.validation_results.get('restore_test') is False:
+            failures.append("Restore Test")
+        return failures
+
+    def validation_passed(self):
+        return self.health_percentage() >= 70 and not self.blocking_failures()
+
+    def as_dict(self):
+        """Validation outcome in the shape of the --json report"""
+        return {
+            'backup_file': self.backup_path,
+            'validation_results': self.validation_results,
+            'details': self.details,
+            'overall_health': self.health_percentage(),
+            'validation_passed': self.validation_passed(),
+            'checks': [{'name': name, 'passed': passed} for name, passed in self.checks],
+            'cached': self.cached,
+            'performance': self.performance(),
+            'timestamp': self.validated_at if self.cached else datetime.now().isoformat()
+        }
+
+    def run_full_validation(self, ledger=None, quiet=False):
+        """Run all validation checks and print a human-readable report"""
+        if quiet:
+            validations = self.run_checks(ledger) or []
+            passed = self.validation_passed()
+            failed = ', '.join(name for name, result in validations if not result)
+            print(f"{'✅' if passed else '❌'} {os.path.basename(self.backup_path)}: "
+                  f"{self.health_percentage():.0f}% healthy" + (f" (failed: {failed})" if failed else ""))
+            return passed
+
+        print(f"🔍 Validating backup: {os.path.basename(self.backup_path)}")
+        print("=" * 60)
+
+        validations = self.run_checks(ledger)
+        if validations is None:
+            print(f"❌ ERROR: Backup file not found: {self.backup_path}")
+            return False
+        if self.cached:
+            print(f"♻️  Unchanged since validation at {self.validated_at}; reusing ledger result")
+
+        for name, result in validations:
+            status = "✅ PASS" if result else "❌ FAIL"
+            print(f"{name:15}: {status}")
 
         # Print detailed results
         print("\n📊 Detailed Results:")
         print("-" * 40)
 
         for key, value in self.details.items():
+            if key in ('dump_toc', 'restore_test'):
+                continue
             if '_error' in key:
                 print(f"❌ {key.replace('_', ' ').title()}: {value}")
             elif '_warning' in key:
@@ -250,15 +1084,56 @@ class OdooBackupValidator:
             else:
                 print(f"ℹ️  {key.replace('_', ' ').title()}: {value}")
 
+        toc = self.details.get('dump_toc')
+        if toc:
+            print(f"\n📦 Dump TOC (archive {toc['archive_version']}, {toc['compression']}, "
+                  f"{toc['toc_entries']} entries, parsed in {toc['parse_ms']} ms):")
+            print("-" * 40)
+            print(f"ℹ️  Database: {toc['database']} (server {toc.get('server_version')}, "
+                  f"pg_dump {toc.get('pg_dump_version')})")
+            counts = ', '.join(f"{desc}: {count}" for desc, count in toc['object_counts'].items())
+            print(f"ℹ️  Objects: {counts}")
+            if toc['offsets_available']:
+                print("ℹ️  Largest tables (data size in archive):")
+                for table in toc['tables'][:10]:
+                    print(f"   {table['size_bytes'] / (1024 * 1024):10.2f} MB  {table['table']}")
+            else:
+                print("⚠️  Dump was written to a pipe; per-table offsets are not recorded")
+
+        restore = self.details.get('restore_test')
+        if restore:
+            print(f"\n⏱️  Restore Test ({restore['jobs']} jobs, restored in {restore['restore_seconds']:.1f}s, "
+                  f"{restore['errors']} errors):")
+            print("-" * 40)
+            counts = ', '.join(f"{table}: {count}" for table, count in restore['row_counts'].items())
+            print(f"ℹ️  Row counts: {counts or 'no core Odoo tables found'}")
+            if restore['slowest_items']:
+                print("ℹ️  Slowest restore items:")
+                for item in restore['slowest_items']:
+                    print(f"   {item['seconds']:8.2f}s  {item['item']}")
+
+        performance = self.performance()
+        print(f"\n⏱️  Performance ({performance['total_seconds']:.2f}s, "
+              f"{performance['bytes_read'] / (1024 * 1024):.1f} MB read):")
+        print("-" * 40)
+        for check, timing in performance['checks'].items():
+            throughput = timing['throughput_mb_s']
+            throughput = f"{throughput:9.1f} MB/s" if throughput is not None else " " * 14
+            print(f"   {check:20} {timing['seconds']:8.3f}s {timing['bytes_processed'] / (1024 * 1024):10.1f} MB"
+                  f" {throughput}")
+
         # Calculate overall health
         passed_checks = sum(self.validation_results.values())
         total_checks = len(self.validation_results)
-        health_percentage = (passed_checks / total_checks) * 100
+        health_percentage = self.health_percentage()
 
         print(f"\n🎯 Overall Health Score: {health_percentage:.0f}% ({passed_checks}/{total_checks} checks passed)")
 
         # Health interpretation
-        if health_percentage >= 85:
+        blocking = self.blocking_failures()
+        if blocking:
+            print(f"🔴 Status: FAILED - {', '.join(blocking)} check failed")
+        elif health_percentage >= 85:
             print("🟢 Status: EXCELLENT - Backup appears to be in good condition")
         elif health_percentage >= 70:
             print("🟡 Status: GOOD - Minor issues detected, but backup should be usable")
@@ -284,43 +1159,300 @@ class OdooBackupValidator:
         if not self.validation_results['timestamp_recent']:
             print("• ℹ️  Backup is older than 7 days - ensure it's the intended version")
 
-        if health_percentage >= 85:
+        if 'filestore_checksum_error' in self.details:
+            print("• ❗ Filestore attachments do not match their checksums - restored files would be corrupt")
+
+        if self.validation_results.get('restore_test') is False:
+            print("• ❗ Restore test failed - this dump could not be restored into a scratch cluster")
+
+        if health_percentage >= 85 and not blocking:
             print("• ✅ Backup validation passed - safe to use for restore")
 
-        return health_percentage >= 70
+        return self.validation_passed()
+
+def _drain(stream):
+    """Read a stream to the end; for ZIP members this verifies the CRC"""
+    while stream.read(STREAM_CHUNK_SIZE):
+        pass
+
+def archive_fingerprint(path):
+    """Size, mtime and a SHA-256 of the first and last MiB of an archive.
+
+    The tail holds the ZIP central directory, with every member's CRC-32,
+    for all but the largest archives; at most 2 MiB is read.
+    """
+    st = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        digest.update(f.read(LEDGER_SAMPLE_SIZE))
+        if st.st_size > LEDGER_SAMPLE_SIZE:
+            f.seek(max(LEDGER_SAMPLE_SIZE, st.st_size - LEDGER_SAMPLE_SIZE))
+            digest.update(f.read(LEDGER_SAMPLE_SIZE))
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'quick_hash': digest.hexdigest()}
+
+def expand_backup_paths(patterns):
+    """Expand files, directories (their *.zip files) and glob patterns"""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(glob.glob(os.path.join(pattern, '*.zip')))
+        elif glob.has_magic(pattern):
+            matches = sorted(p for p in glob.glob(pattern) if os.path.isfile(p))
+        else:
+            matches = [pattern]
+        for path in matches:
+            path = os.path.abspath(path)
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+def parse_verify_spec(value):
+    """Parse --verify-filestore: 'all' or 'sample=N%' into a fraction"""
+    if value == 'all':
+        return 1.0
+    match = re.fullmatch(r'sample=(\d+(?:\.\d+)?)%?', value)
+    if not match or not 0 < float(match.group(1)) <= 100:
+        raise argparse.ArgumentTypeError("expected 'all' or 'sample=N%' with 0 < N <= 100")
+    return float(match.group(1)) / 100
+
+def _validate_for_batch(path, options=None):
+    """Process-pool worker: validate one archive without printing"""
+    started = time.perf_counter()
+    validator = OdooBackupValidator(path, **(options or {}))
+    validator.run_checks()
+    result = validator.as_dict()
+    result['duration_s'] = round(time.perf_counter() - started, 3)
+    return result
+
+def validate_batch(paths, jobs, ledger=None, options=None):
+    """Validate many archives concurrently and aggregate the results.
+
+    Archives with a matching entry in `ledger` are not re-read; fresh
+    results are recorded there. `options` are passed to OdooBackupValidator.
+    `jobs` bounds how many archives are streamed at once, which is usually
+    limited by disk throughput rather than CPU.
+    """
+    started = time.perf_counter()
+    archives = [None] * len(paths)
+    fingerprints = {}
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for index, path in enumerate(paths):
+            if ledger:
+                try:
+                    fingerprints[index] = archive_fingerprint(path)
+                except OSError as e:
+                    archives[index] = {'backup_file': path, 'validation_passed': False, 'cached': False,
+                                       'details': {'file_error': str(e)}, 'timestamp': datetime.now().isoformat()}
+                    continue
+                validator = OdooBackupValidator(path, **(options or {}))
+                cached = ledger.lookup(path, fingerprints[index], validator.check_options)
+                if cached:
+                    validator.load_result(cached)
+                    archives[index] = validator.as_dict()
+                    continue
+            futures[index] = executor.submit(_validate_for_batch, path, options)
+
+        for index, future in futures.items():
+            archives[index] = future.result()
+            if ledger and os.path.exists(paths[index]):
+                check_options = OdooBackupValidator(paths[index], **(options or {})).check_options
+                ledger.record(paths[index], fingerprints[index], check_options, archives[index])
+
+    passed = sum(1 for a in archives if a['validation_passed'])
+    return {
+        'generated': datetime.now().isoformat(),
+        'jobs': jobs,
+        'archive_count': len(archives),
+        'passed': passed,
+        'failed': len(archives) - passed,
+        'cached': sum(1 for a in archives if a.get('cached')),
+        'duration_s': round(time.perf_counter() - started, 3),
+        'archives': archives
+    }
+
+def _prometheus_labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+
+def write_prometheus_textfile(path, results):
+    """Write validation results in the node_exporter textfile format.
+
+    The file is written next to its destination and renamed into place, so
+    the textfile collector never reads a partial file.
+    """
+    metrics = {
+        'odoo_backup_validation_passed': ('gauge', 'Whether the backup passed validation'),
+        'odoo_backup_validation_health_percent': ('gauge', 'Share of validation checks passed'),
+        'odoo_backup_validation_cached': ('gauge', 'Whether the result was reused from the ledger'),
+        'odoo_backup_validation_duration_seconds': ('gauge', 'Wall time of the validation run'),
+        'odoo_backup_validation_check_passed': ('gauge', 'Outcome of each validation check'),
+        'odoo_backup_validation_check_duration_seconds': ('gauge', 'Wall time spent per check'),
+        'odoo_backup_validation_check_bytes_read': ('gauge', 'Bytes read from disk per check'),
+        'odoo_backup_validation_check_bytes_processed': ('gauge', 'Uncompressed bytes processed per check'),
+        'odoo_backup_validation_last_run_timestamp_seconds': ('gauge', 'Unix time of the validation run'),
+    }
+    samples = {name: [] for name in metrics}
+    now = time.time()
+    for result in results:
+        path_label = os.path.abspath(result['backup_file'])
+        backup = {'backup': os.path.basename(path_label), 'path': path_label}
+        labels = _prometheus_labels(**backup)
+        samples['odoo_backup_validation_passed'].append((labels, int(bool(result['validation_passed']))))
+        samples['odoo_backup_validation_health_percent'].append((labels, result.get('overall_health', 0)))
+        samples['odoo_backup_validation_cached'].append((labels, int(bool(result.get('cached')))))
+        samples['odoo_backup_validation_last_run_timestamp_seconds'].append((labels, round(now, 3)))
+        performance = result.get('performance', {})
+        samples['odoo_backup_validation_duration_seconds'].append((labels, performance.get('total_seconds', 0)))
+        for check, passed in result.get('validation_results', {}).items():
+            samples['odoo_backup_validation_check_passed'].append(
+                (_prometheus_labels(**backup, check=check), int(bool(passed))))
+        for check, timing in performance.get('checks', {}).items():
+            check_labels = _prometheus_labels(**backup, check=check)
+            samples['odoo_backup_validation_check_duration_seconds'].append((check_labels, timing['seconds']))
+            samples['odoo_backup_validation_check_bytes_read'].append((check_labels, timing['bytes_read']))
+            samples['odoo_backup_validation_check_bytes_processed'].append((check_labels, timing['bytes_processed']))
+
+    lines = []
+    for name, (metric_type, help_text) in metrics.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(f"{name}{labels} {value}" for labels, value in samples[name])
+
+    fd, tmp_path = tempfile.mkstemp(prefix='.odoo_backup_validation.', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
 
 def main():
     parser = argparse.ArgumentParser(description='Validate Odoo backup files')
-    parser.add_argument('backup_file', help='Path to the backup ZIP file to validate')
+    parser.add_argument('backup_file', nargs='+',
+                        help='Backup ZIP file to validate; several files, directories or glob patterns run in batch mode')
     parser.add_argument('--quiet', '-q', action='store_true', help='Reduce output verbosity')
     parser.add_argument('--json', action='store_true', help='Output results in JSON format')
+    parser.add_argument('--verify-filestore', type=parse_verify_spec, metavar='sample=N%|all',
+                        help='Check that filestore files hash to their SHA-1 names, for a random sample or all of them')
+    parser.add_argument('--verify-workers', type=int, help='Threads hashing filestore files (default: CPU count, max 8)')
+    parser.add_argument('--verify-budget', type=float, metavar='SECONDS',
+                        help='Stop starting new filestore checksums after this many seconds')
+    parser.add_argument('--restore-test', action='store_true',
+                        help='Also restore the dump into a throwaway local PostgreSQL cluster (needs initdb)')
+    parser.add_argument('--restore-jobs', type=int, help='Parallel pg_restore jobs for the restore test (default: 4)')
+    parser.add_argument('--restore-dir', help='Scratch directory for the restore test cluster (default: /dev/shm if the '
+                             'restored database fits, else TMPDIR; dumps are extracted under TMPDIR)')
+    parser.add_argument('--pg-bin', help='Directory with the PostgreSQL binaries (default: search PATH)')
+    parser.add_argument('--jobs', '-j', type=int, default=min(4, os.cpu_count() or 1),
+                        help='Archives validated concurrently in batch mode; lower it for slow disks (default: %(default)s)')
+    parser.add_argument('--report', help='Also write the aggregated batch JSON report to this file')
+    parser.add_argument('--ledger', help='SQLite validation ledger; unchanged archives reuse their recorded result')
+    parser.add_argument('--ledger-max-age', type=float, metavar='HOURS',
+                        help='Re-validate archives whose ledger entry is older than this')
+    parser.add_argument('--prometheus', metavar='FILE',
+                        help='Write results as a Prometheus node_exporter textfile (replaced atomically)')
+    parser.add_argument('--revalidate', action='store_true', help='Ignore ledger entries but record new results')
 
     args = parser.parse_args()
 
+    patterns = args.backup_file
+    if len(patterns) > 1 or os.path.isdir(patterns[0]) or glob.has_magic(patterns[0]):
+        sys.exit(run_batch(args))
+
+    args.backup_file = patterns[0]
     if not os.path.exists(args.backup_file):
-        print(f"Error: File not found: {args.backup_file}")
+        print(f"Error: File not found: {args.backup_file}", file=sys.stderr)
         sys.exit(1)
 
-    validator = OdooBackupValidator(args.backup_file)
+    validator = OdooBackupValidator(args.backup_file, **_validator_options(args))
+    ledger = _open_ledger(args)
 
-    if args.json:
-        # JSON output for automation
-        result = validator.run_full_validation()
-        output = {
-            'backup_file': args.backup_file,
-            'validation_results': validator.validation_results,
-            'details': validator.details,
-            'overall_health': sum(validator.validation_results.values()) / len(validator.validation_results) * 100,
-            'validation_passed': result,
-            'timestamp': datetime.now().isoformat()
-        }
-        print(json.dumps(output, indent=2))
-    else:
-        # Human-readable output
-        result = validator.run_full_validation()
+    try:
+        if args.json:
+            # JSON output for automation; nothing else goes to stdout
+            validator.run_checks(ledger)
+            output = validator.as_dict()
+            result = output['validation_passed']
+            print(json.dumps(output, indent=2))
+        else:
+            # Human-readable output
+            result = validator.run_full_validation(ledger, quiet=args.quiet)
+    finally:
+        if ledger:
+            ledger.close()
+
+    if args.prometheus:
+        write_prometheus_textfile(args.prometheus, [validator.as_dict()])
 
     # Exit with appropriate code
     sys.exit(0 if result else 1)
 
+def _validator_options(args):
+    options = {}
+    if args.verify_filestore:
+        options.update(verify_filestore=args.verify_filestore, verify_workers=args.verify_workers,
+                       verify_budget=args.verify_budget)
+    if args.restore_test:
+        options.update(restore_test=True, restore_jobs=args.restore_jobs, restore_dir=args.restore_dir,
+                       pg_bin=args.pg_bin)
+    return options
+
+def _open_ledger(args):
+    if not args.ledger:
+        return None
+    # --revalidate keeps recording but never finds a usable entry
+    max_age = 0 if args.revalidate else (args.ledger_max_age * 3600 if args.ledger_max_age else None)
+    return ValidationLedger(args.ledger, max_age)
+
+def run_batch(args):
+    """Validate every matched archive; returns the process exit code"""
+    paths = expand_backup_paths(args.backup_file)
+    if not paths:
+        print("Error: No backup archives matched")
+        return 1
+
+    ledger = _open_ledger(args)
+    try:
+        report = validate_batch(paths, max(1, args.jobs), ledger, _validator_options(args))
+    finally:
+        if ledger:
+            ledger.close()
+    if args.report:
+        _write_json_atomic(args.report, report)
+    if args.prometheus:
+        write_prometheus_textfile(args.prometheus, report['archives'])
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"🔍 Validated {report['archive_count']} backups with {report['jobs']} jobs "
+              f"in {report['duration_s']:.1f}s")
+        print("=" * 60)
+        for archive in report['archives']:
+            if args.quiet and archive['validation_passed']:
+                continue
+            if archive.get('cached'):
+                status = "⏭️  SKIP"
+            else:
+                status = "✅ PASS" if archive['validation_passed'] else "❌ FAIL"
+            health = archive.get('overall_health')
+            health = f"{health:3.0f}%" if health is not None else "  - "
+            print(f"{status}  {health}  {archive['backup_file']}")
+        print(f"\n🎯 {report['passed']} passed, {report['failed']} failed, "
+              f"{report['cached']} reused from the ledger")
+
+    return 0 if report['failed'] == 0 else 1
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
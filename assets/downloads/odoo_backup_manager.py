@@ -6,15 +6,716 @@ Created by Aria Shaw - 2025
 """
 
 import os
+import queue
 import sys
 import json
 import logging
 import subprocess
 import datetime
 import configparser
+import fcntl
+import hashlib
 import argparse
+import re
+import shutil
+import sqlite3
+import stat
+import tarfile
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+
+# Default number of concurrent jobs per backup stage
+STAGE_LIMITS = {'dumps': 4, 'archives': 2, 'uploads': 8}
+
+# Leading bytes of file types whose content is already compressed
+COMPRESSED_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF8', 'image/gif'),
+    (b'%PDF', 'application/pdf'),
+    (b'PK\x03\x04', 'application/zip'),  # also docx/xlsx/odt
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'BZh', 'application/x-bzip2'),
+    (b'\xfd7zXZ\x00', 'application/x-xz'),
+    (b'\x28\xb5\x2f\xfd', 'application/zstd'),
+    (b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (b'Rar!', 'application/vnd.rar'),
+    (b'OggS', 'audio/ogg'),
+    (b'ID3', 'audio/mpeg'),
+    (b'\x1aE\xdf\xa3', 'video/webm'),
+    (b'wOFF', 'font/woff'),
+    (b'wOF2', 'font/woff2'),
+]
+
+# Odoo names filestore attachments after the SHA-1 of their content: ab/ab12...
+BLOB_NAME = re.compile(r'^[0-9a-f]{40}$')
+
+# S3 multipart limits: parts of at least 5 MiB (except the last), at most 10000 parts
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MAX_PARTS = 10000
+
+# Streaming pipeline: read size, and chunks buffered between a writer and an S3 upload
+PIPELINE_CHUNK_SIZE = 1024 * 1024
+PIPELINE_QUEUE_CHUNKS = 8
+
+# Default retention: everything from the last keep_days and never fewer than min_good.
+# The daily/weekly/monthly GFS rules only apply when set in [retention].
+RETENTION_POLICY = {'keep_days': 30, 'daily': 0, 'weekly': 0, 'monthly': 0, 'min_good': 3}
+
+# S3 DeleteObjects accepts at most this many keys per request
+S3_DELETE_BATCH = 1000
+
+# In format=auto, databases at least this large use the parallel directory format
+DIRECTORY_FORMAT_THRESHOLD_GB = 20
+
+class StageExecutor:
+    """Bounded thread pools, one per backup stage.
+
+    Each stage has its own limit, so e.g. 4 pg_dumps, 2 filestore archives
+    and 8 uploads can be in flight at once while every database still
+    moves through its own stages in order.
+    """
+
+    def __init__(self, limits: Dict[str, int]):
+        self.pools = {stage: ThreadPoolExecutor(max_workers=max(1, limit), thread_name_prefix=f'backup-{stage}')
+                      for stage, limit in limits.items()}
+
+    def submit(self, stage: str, fn, *args):
+        return self.pools[stage].submit(fn, *args)
+
+    def shutdown(self):
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
+
+def sniff_compressed_type(head: bytes) -> Optional[str]:
+    """MIME type of already-compressed content, from its first bytes"""
+    for signature, mime_type in COMPRESSED_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:8] == b'ftyp':
+        return 'video/mp4'  # MP4/MOV/HEIC containers
+    return None
+
+class ParallelGzipWriter:
+    """Writes a gzip stream to `out` using a pool of compression threads.
+
+    Data is cut into blocks that are compressed independently and written
+    in order as concatenated gzip members (as pigz does), which every gzip
+    reader accepts. At most workers * 4 blocks are in flight. Callers can
+    write a block at level 0 to store already-compressed content as-is.
+    """
+
+    def __init__(self, out, workers: Optional[int] = None, level: int = 6, block_size: int = 1024 * 1024):
+        self.out = out
+        self.workers = workers or os.cpu_count() or 1
+        self.level = level
+        self.block_size = block_size
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='gzip')
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.buffer_level = level
+        self.bytes_in = self.bytes_stored = self.bytes_out = 0
+
+    @staticmethod
+    def _compress_block(data: bytes, level: int) -> bytes:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31 = gzip member
+        return compressor.compress(data) + compressor.flush()
+
+    def write(self, data: bytes, level: Optional[int] = None):
+        level = self.level if level is None else level
+        if self.buffer and level != self.buffer_level:
+            self._flush()
+        self.buffer_level = level
+        self.buffer.extend(data)
+        self.bytes_in += len(data)
+        if level == 0:
+            self.bytes_stored += len(data)
+        if len(self.buffer) >= self.block_size:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.pending.append(self.executor.submit(self._compress_block, bytes(self.buffer), self.buffer_level))
+            self.buffer = bytearray()
+        while len(self.pending) > self.workers * 4:
+            self._write_block()
+
+    def _write_block(self):
+        block = self.pending.popleft().result()
+        self.out.write(block)
+        self.bytes_out += len(block)
+
+    def finish(self):
+        """Compress and write everything buffered; `out` is left open"""
+        self._flush()
+        while self.pending:
+            self._write_block()
+        self.executor.shutdown(wait=True)
+
+    def abort(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+class FilestoreArchiver:
+    """Writes a filestore as .tar.gz using parallel, type-aware gzip.
+
+    The tar stream goes through a ParallelGzipWriter. Already-compressed
+    attachments (Odoo stores them without extensions, so they are
+    recognised by content) go into level-0 blocks instead of being
+    recompressed. Hard links, e.g. from filestore deduplication, stay
+    hard links in the archive.
+    """
+
+    def __init__(self, workers: Optional[int] = None, level: int = 6, block_size: int = 1024 * 1024):
+        self.workers = workers or os.cpu_count() or 1
+        self.level = level
+        self.block_size = block_size
+
+    def archive(self, source_dir: str, arcname: str, dest_path: str) -> Dict[str, int]:
+        """Archive source_dir as arcname/... into dest_path; returns byte and file counts"""
+        partial_path = f"{dest_path}.part"
+        try:
+            with open(partial_path, 'wb') as out:
+                stats = self.archive_to(source_dir, arcname, out)
+        except BaseException:
+            _remove_path(partial_path)
+            raise
+        os.replace(partial_path, dest_path)
+        return stats
+
+    def archive_to(self, source_dir: str, arcname: str, out) -> Dict[str, int]:
+        """Write the .tar.gz of source_dir to the writable `out`; returns byte and file counts"""
+        stats = {'files': 0, 'files_changed': 0, 'bytes_in': 0, 'bytes_stored': 0, 'bytes_out': 0}
+        gz = ParallelGzipWriter(out, self.workers, self.level, self.block_size)
+        tar_size = 0
+
+        def emit(data: bytes, level: int):
+            nonlocal tar_size
+            gz.write(data, level)
+            tar_size += len(data)
+
+        try:
+            links = {}
+            for path, info in self._walk(source_dir, arcname):
+                if info.isreg():
+                    st = os.lstat(path)
+                    key = (st.st_dev, st.st_ino)
+                    if st.st_nlink > 1 and key in links:
+                        info.type, info.linkname, info.size = tarfile.LNKTYPE, links[key], 0
+                        emit(info.tobuf(tarfile.PAX_FORMAT), self.level)
+                        continue
+                    links[key] = info.name
+                    with open(path, 'rb') as f:
+                        # The header already holds the lstat size, so write exactly
+                        # that many bytes even if the file changes while being read
+                        remaining = info.size
+                        chunk = f.read(min(self.block_size, remaining))
+                        level = 0 if sniff_compressed_type(chunk[:16]) else self.level
+                        emit(info.tobuf(tarfile.PAX_FORMAT), level)
+                        shrank = False
+                        while remaining:
+                            if not chunk:
+                                chunk = tarfile.NUL * min(self.block_size, remaining)  # pad like tar does
+                                shrank = True
+                            emit(chunk, level)
+                            remaining -= len(chunk)
+                            chunk = f.read(min(self.block_size, remaining)) if remaining else b''
+                        if shrank or f.read(1):
+                            stats['files_changed'] += 1
+                    if info.size % tarfile.BLOCKSIZE:
+                        emit(tarfile.NUL * (tarfile.BLOCKSIZE - info.size % tarfile.BLOCKSIZE), level)
+                    stats['files'] += 1
+                    stats['bytes_in'] += info.size
+                else:
+                    emit(info.tobuf(tarfile.PAX_FORMAT), self.level)
+
+            # End-of-archive marker, padded to a full record like tar does
+            trailer = 2 * tarfile.BLOCKSIZE
+            trailer += -(tar_size + trailer) % tarfile.RECORDSIZE
+            emit(tarfile.NUL * trailer, self.level)
+            gz.finish()
+        except BaseException:
+            gz.abort()
+            raise
+
+        stats['bytes_stored'], stats['bytes_out'] = gz.bytes_stored, gz.bytes_out
+        return stats
+
+    def _walk(self, source_dir: str, arcname: str):
+        """Yield (path, TarInfo) for the tree in a stable order"""
+        for root, dirs, files in os.walk(source_dir, onerror=_raise):
+            dirs.sort()
+            relative = os.path.relpath(root, source_dir)
+            prefix = arcname if relative == '.' else f"{arcname}/{relative}"
+            yield root, self._tarinfo(root, prefix)
+            # os.walk lists symlinks to directories with the directories
+            links = [name for name in dirs if os.path.islink(os.path.join(root, name))]
+            dirs[:] = [name for name in dirs if name not in links]
+            for name in sorted(files + links):
+                path = os.path.join(root, name)
+                info = self._tarinfo(path, f"{prefix}/{name}")
+                if info is not None:
+                    yield path, info
+
+    @staticmethod
+    def _tarinfo(path: str, name: str) -> Optional[tarfile.TarInfo]:
+        st = os.lstat(path)
+        info = tarfile.TarInfo(name)
+        info.mode = stat.S_IMODE(st.st_mode)
+        info.uid, info.gid = st.st_uid, st.st_gid
+        info.mtime = int(st.st_mtime)
+        if stat.S_ISREG(st.st_mode):
+            info.size = st.st_size
+        elif stat.S_ISDIR(st.st_mode):
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(st.st_mode):
+            info.type, info.linkname = tarfile.SYMTYPE, os.readlink(path)
+        else:
+            return None  # sockets, fifos and devices have no place in a filestore
+        return info
+
+class BlobIndex:
+    """SQLite index of the filestore blobs kept in the content-addressed store.
+
+    Blobs are keyed by SHA-1, so an attachment shared by several databases
+    is stored and uploaded once. The index is shared by the concurrent
+    archive and upload stages, hence the lock. Every backup run also holds
+    a shared flock on the store, so garbage collection can tell when
+    another run may still catalogue snapshots using its blobs.
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.claimed = set()
+        self.lock_file = open(f"{path}.lock", 'a')
+        fcntl.flock(self.lock_file, fcntl.LOCK_SH)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                sha1 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                stored_at TEXT NOT NULL,
+                uploaded_at TEXT
+            )
+        """)
+        self.conn.commit()
+
+    def known(self, sha1: str) -> bool:
+        with self.lock:
+            return self.conn.execute('SELECT 1 FROM blobs WHERE sha1 = ?', (sha1,)).fetchone() is not None
+
+    def add(self, sha1: str, size: int):
+        with self.lock:
+            self.conn.execute('INSERT OR IGNORE INTO blobs (sha1, size, stored_at) VALUES (?, ?, ?)',
+                              (sha1, size, datetime.datetime.now().isoformat()))
+
+    def commit(self):
+        """Flush the blobs added since the last commit; called once per snapshot"""
+        with self.lock:
+            self.conn.commit()
+
+    def lock_exclusive(self) -> bool:
+        """Try to take the store for garbage collection; False while another run uses it"""
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            fcntl.flock(self.lock_file, fcntl.LOCK_SH)  # a failed upgrade may drop the shared lock
+            return False
+
+    def unlock_exclusive(self):
+        fcntl.flock(self.lock_file, fcntl.LOCK_SH)
+
+    def unreferenced(self, snapshot_files: List[str]) -> List[Tuple[str, bool]]:
+        """Blobs that none of the snapshots use, as (sha1, uploaded) pairs.
+
+        The referenced set is staged in a temporary table rather than in memory.
+        """
+        with self.lock:
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS referenced (sha1 TEXT PRIMARY KEY)')
+            try:
+                for snapshot_file in snapshot_files:
+                    with open(snapshot_file) as f:
+                        sha1s = json.load(f)['files'].values()
+                    self.conn.executemany('INSERT OR IGNORE INTO referenced VALUES (?)', ((sha1,) for sha1 in sha1s))
+                return [(sha1, uploaded_at is not None) for sha1, uploaded_at in self.conn.execute(
+                    'SELECT sha1, uploaded_at FROM blobs WHERE sha1 NOT IN (SELECT sha1 FROM referenced)')]
+            finally:
+                self.conn.execute('DELETE FROM referenced')
+
+    def remove(self, sha1s: List[str]):
+        with self.lock:
+            self.conn.executemany('DELETE FROM blobs WHERE sha1 = ?', ((sha1,) for sha1 in sha1s))
+            self.conn.commit()
+
+    def claim_uploads(self, sha1s) -> List[str]:
+        """Blobs among sha1s not uploaded yet and not being uploaded by another database"""
+        with self.lock:
+            pending = {row[0] for row in self.conn.execute('SELECT sha1 FROM blobs WHERE uploaded_at IS NULL')}
+            claims = sorted(pending.intersection(sha1s) - self.claimed)
+            self.claimed.update(claims)
+            return claims
+
+    def finish_upload(self, sha1: str, uploaded: bool):
+        with self.lock:
+            self.claimed.discard(sha1)
+            if uploaded:
+                self.conn.execute('UPDATE blobs SET uploaded_at = ? WHERE sha1 = ?',
+                                  (datetime.datetime.now().isoformat(), sha1))
+                self.conn.commit()
+
+class S3Uploader:
+    """Concurrent multipart uploads through one shared S3 client.
+
+    Objects are read part by part from any binary stream (a file or a
+    pipe such as pg_dump's stdout), so nothing has to be on disk first.
+    Parts of all uploads share one pool of `concurrency` threads, and at
+    most twice that many parts are buffered at once. Streams that fit in
+    a single part are sent with one PutObject.
+    """
+
+    def __init__(self, region: Optional[str] = None, endpoint_url: Optional[str] = None,
+                 part_size: int = 16 * 1024 * 1024, concurrency: int = 8):
+        import boto3
+        from botocore.config import Config
+
+        self.part_size = max(part_size, S3_MIN_PART_SIZE)
+        self.concurrency = max(1, concurrency)
+        # Clients are thread-safe (sessions are not); one client shares its connection pool
+        self.client = boto3.session.Session().client(
+            's3', region_name=region or None, endpoint_url=endpoint_url or None,
+            config=Config(max_pool_connections=max(10, self.concurrency * 2)))
+        self.pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='s3-part')
+        self.buffered_parts = threading.BoundedSemaphore(self.concurrency * 2)
+
+    def upload_file(self, file_path: str, bucket: str, key: str) -> int:
+        with open(file_path, 'rb') as f:
+            return self.upload_stream(f, bucket, key)
+
+    def upload_stream(self, stream, bucket: str, key: str, complete_if=None) -> Optional[int]:
+        """Upload everything read from stream as key; returns the byte count.
+
+        complete_if, if given, is called once the stream is exhausted; when
+        it returns False (e.g. the producing process failed) the upload is
+        aborted and None is returned, so no partial object is left behind.
+        """
+        data = self._read_part(stream, self.part_size)
+        if len(data) < self.part_size:
+            try:
+                if complete_if is not None and not complete_if():
+                    return None
+                self.client.put_object(Bucket=bucket, Key=key, Body=data)
+                return len(data)
+            finally:
+                if data:
+                    self.buffered_parts.release()
+
+        try:
+            upload_id = self.client.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+        except BaseException:
+            self.buffered_parts.release()
+            raise
+        parts, pending = [], deque()
+        total = 0
+        try:
+            number = 1
+            while data:
+                pending.append(self.pool.submit(self._upload_part, bucket, key, upload_id, number, data))
+                total += len(data)
+                number += 1
+                while pending and pending[0].done():
+                    parts.append(pending.popleft().result())
+                # Grow parts for long streams so the 10000-part limit is never reached
+                data = self._read_part(stream, self.part_size * 2 ** (number // (S3_MAX_PARTS // 5)))
+            while pending:
+                parts.append(pending.popleft().result())
+            if complete_if is not None and not complete_if():
+                self.client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+                return None
+            self.client.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                                                  MultipartUpload={'Parts': parts})
+            return total
+        except BaseException:
+            for future in pending:
+                if future.cancel():
+                    self.buffered_parts.release()
+            for future in pending:
+                if not future.cancelled():
+                    future.exception()  # let in-flight parts finish before aborting
+            self.client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            raise
+
+    def _read_part(self, stream, size: int) -> bytes:
+        """Read up to size bytes; a non-empty part holds a buffer slot until it is uploaded"""
+        self.buffered_parts.acquire()
+        try:
+            data = stream.read(size)
+        except BaseException:
+            self.buffered_parts.release()
+            raise
+        if not data:
+            self.buffered_parts.release()
+        return data
+
+    def _upload_part(self, bucket: str, key: str, upload_id: str, number: int, data: bytes) -> Dict:
+        try:
+            response = self.client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id,
+                                               PartNumber=number, Body=data)
+            return {'PartNumber': number, 'ETag': response['ETag']}
+        finally:
+            self.buffered_parts.release()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+class FileSink:
+    """Pipeline sink writing to a local file, renamed into place on close"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.partial_path = f"{path}.part"
+        self.file = open(self.partial_path, 'wb')
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.partial_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        _remove_path(self.partial_path)
+
+class S3Sink:
+    """Pipeline sink feeding a multipart upload through a bounded queue.
+
+    The upload runs on its own thread and reads what the pipeline writes;
+    a writer that gets more than PIPELINE_QUEUE_CHUNKS ahead blocks.
+    """
+
+    def __init__(self, uploader: S3Uploader, bucket: str, key: str):
+        self.chunks = queue.Queue(maxsize=PIPELINE_QUEUE_CHUNKS)
+        self.buffer = bytearray()
+        self.eof = False
+        self.aborted = False
+        self.error = None
+        self.size = 0
+        self.uploaded = None
+        self.thread = threading.Thread(target=self._upload, args=(uploader, bucket, key), daemon=True)
+        self.thread.start()
+
+    def _upload(self, uploader: S3Uploader, bucket: str, key: str):
+        try:
+            self.uploaded = uploader.upload_stream(self, bucket, key, complete_if=lambda: not self.aborted)
+        except Exception as e:
+            self.error = e
+
+    def read(self, size: int) -> bytes:
+        """Called by the upload thread"""
+        while len(self.buffer) < size and not self.eof:
+            chunk = self.chunks.get()
+            if chunk is None:
+                self.eof = True
+            else:
+                self.buffer.extend(chunk)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def _put(self, chunk: Optional[bytes]):
+        while True:
+            if not self.thread.is_alive():
+                raise OSError(f"S3 upload failed: {self.error}")
+            try:
+                self.chunks.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data: bytes):
+        self._put(data)
+        self.size += len(data)
+
+    def close(self):
+        self._put(None)
+        self.thread.join()
+        if self.error is not None or self.uploaded is None:
+            raise OSError(f"S3 upload failed: {self.error}")
+
+    def abort(self):
+        self.aborted = True
+        if self.thread.is_alive():
+            self._put(None)
+            self.thread.join()
+
+class TeeSink:
+    """Pipeline sink copying the stream to several sinks"""
+
+    def __init__(self, sinks: List):
+        self.sinks = sinks
+
+    @property
+    def size(self) -> int:
+        return self.sinks[0].size
+
+    def write(self, data: bytes):
+        for sink in self.sinks:
+            sink.write(data)
+
+    def close(self):
+        for i, sink in enumerate(self.sinks):
+            try:
+                sink.close()
+            except BaseException:
+                for remaining in self.sinks[i:]:
+                    remaining.abort()
+                raise
+
+    def abort(self):
+        for sink in self.sinks:
+            sink.abort()
+
+class GpgEncryptor:
+    """Pipeline stage encrypting the stream to a public key with gpg.
+
+    Only the recipient's public key is needed on the backup host. gpg's
+    own compression is disabled since its input is already compressed.
+    """
+
+    def __init__(self, recipient: str, out):
+        self.out = out
+        self.process = subprocess.Popen(
+            ['gpg', '--batch', '--yes', '--no-tty', '--trust-model', 'always', '--compress-algo', 'none',
+             '--encrypt', '--recipient', recipient, '--output', '-'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.error = None
+        self.stderr = []
+        self.pump = threading.Thread(target=self._pump, daemon=True)
+        self.reader = threading.Thread(target=lambda: self.stderr.append(self.process.stderr.read()), daemon=True)
+        self.pump.start()
+        self.reader.start()
+
+    @property
+    def size(self) -> int:
+        return self.out.size
+
+    def _pump(self):
+        try:
+            for chunk in iter(lambda: self.process.stdout.read(PIPELINE_CHUNK_SIZE), b''):
+                self.out.write(chunk)
+        except Exception as e:
+            self.error = e
+            self.process.kill()  # unblocks a writer waiting on gpg's stdin
+
+    def _failure(self) -> OSError:
+        self.reader.join()
+        detail = self.error or b''.join(self.stderr).decode(errors='replace').strip()
+        return OSError(f"gpg encryption failed: {detail}")
+
+    def write(self, data: bytes):
+        try:
+            self.process.stdin.write(data)
+        except BrokenPipeError:
+            self.process.wait()
+            self.pump.join()
+            raise self._failure()
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.pump.join()
+        if self.process.wait() != 0 or self.error is not None:
+            self.out.abort()
+            raise self._failure()
+        self.reader.join()
+        self.out.close()
+
+    def abort(self):
+        self.process.kill()
+        self.process.wait()
+        self.pump.join()
+        self.out.abort()
+
+class BackupCatalog:
+    """SQLite catalog of completed backups, one row per manifest.
+
+    Retention reads the catalog instead of listing the backup directory.
+    Artifact locations are local paths or s3:// URLs.
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.created = not os.path.exists(path)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS backups (
+                manifest_file TEXT PRIMARY KEY,
+                database_name TEXT NOT NULL,
+                backup_date TEXT NOT NULL,
+                database_file TEXT,
+                filestore_file TEXT,
+                size_mb REAL
+            )
+        """)
+        self.conn.execute('CREATE INDEX IF NOT EXISTS backups_by_database ON backups (database_name, backup_date)')
+        self.conn.commit()
+
+    def add(self, manifest_file: str, manifest: Dict, database_file: str, filestore_file: Optional[str]):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?, ?)',
+                              (manifest_file, manifest['database_name'], manifest['backup_date'],
+                               database_file, filestore_file, manifest.get('backup_size_mb')))
+            self.conn.commit()
+
+    def backups(self) -> List[Dict]:
+        with self.lock:
+            cursor = self.conn.execute('SELECT * FROM backups ORDER BY database_name, backup_date DESC')
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor]
+
+    def remove(self, manifest_files: List[str]):
+        with self.lock:
+            self.conn.executemany('DELETE FROM backups WHERE manifest_file = ?', [(f,) for f in manifest_files])
+            self.conn.commit()
+
+def plan_retention(backups: List[Dict], policy: Dict[str, int], now: datetime.datetime) -> List[Dict]:
+    """Backups the GFS policy no longer keeps, decided per database from catalog rows"""
+    by_database = {}
+    for backup in backups:
+        by_database.setdefault(backup['database_name'], []).append(backup)
+
+    expired = []
+    cutoff = now - datetime.timedelta(days=policy['keep_days'])
+    periods = (('daily', lambda d: d.date()),
+               ('weekly', lambda d: d.isocalendar()[:2]),
+               ('monthly', lambda d: (d.year, d.month)))
+    for group in by_database.values():
+        group.sort(key=lambda b: b['backup_date'], reverse=True)
+        dates = [datetime.datetime.fromisoformat(b['backup_date']) for b in group]
+        # The newest good backups survive whatever their age, even when recent runs failed
+        keep = set(range(min(policy['min_good'], len(group))))
+        keep.update(i for i, date in enumerate(dates) if date >= cutoff)
+        for name, period_of in periods:
+            seen = set()
+            for i, date in enumerate(dates):
+                period = period_of(date)
+                if period not in seen:
+                    if len(seen) >= policy[name]:
+                        break
+                    seen.add(period)
+                    keep.add(i)
+        expired.extend(backup for i, backup in enumerate(group) if i not in keep)
+    return expired
 
 class OdooBackupManager:
     def __init__(self, config_file: str = 'backup_config.ini'):
@@ -32,62 +733,45 @@ class OdooBackupManager:
             ]
         )
         self.logger = logging.getLogger(__name__)
+        self._pg_dump_major = None
+        self._init_lock = threading.Lock()  # guards the lazily initialised attributes below
+        self._blob_index = None
+        self._s3_uploader = None
+        self._catalog = None
 
-    def backup_database(self, db_name: str, backup_dir: str) -> Dict[str, str]:
-        """Backup a single Odoo database using pg_dump"""
-        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-
-        # Database backup
-        db_file = f"{backup_dir}/{db_name}_db_{timestamp}.dump"
-        db_cmd = [
-            'pg_dump',
-            '-h', self.config.get('database', 'host', fallback='localhost'),
-            '-p', self.config.get('database', 'port', fallback='5432'),
-            '-U', self.config.get('database', 'user', fallback='odoo'),
-            '--format=custom',
-            '--compress=9',
-            '--verbose',
-            f'--file={db_file}',
-            db_name
-        ]
+    def backup_database(self, db_name: str, backup_dir: str,
+                        stages: Optional[StageExecutor] = None) -> Dict[str, str]:
+        """Backup a single Odoo database using pg_dump.
 
-        # Set password environment variable
-        env = os.environ.copy()
-        env['PGPASSWORD'] = self.config.get('database', 'password')
+        The dump and the filestore archive run concurrently on `stages`
+        (a private single-slot executor if none is given).
+        """
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        own_stages = stages is None
+        if own_stages:
+            stages = StageExecutor({'dumps': 1, 'archives': 1})
 
         try:
             self.logger.info(f"Starting database backup for {db_name}")
-            result = subprocess.run(db_cmd, env=env, capture_output=True, text=True)
-
-            if result.returncode != 0:
-                self.logger.error(f"Database backup failed: {result.stderr}")
-                return {'status': 'failed', 'error': result.stderr}
-
-            # Filestore backup
-            filestore_path = Path(self.config.get('odoo', 'filestore_path', fallback='/var/lib/odoo/filestore')) / db_name
-            fs_file = None
-
-            if filestore_path.exists():
-                fs_file = f"{backup_dir}/{db_name}_filestore_{timestamp}.tar.gz"
-                tar_cmd = ['tar', '-czf', fs_file, '-C', str(filestore_path.parent), db_name]
-
-                fs_result = subprocess.run(tar_cmd, capture_output=True, text=True)
-                if fs_result.returncode != 0:
-                    self.logger.warning(f"Filestore backup failed: {fs_result.stderr}")
-                    fs_file = None
-
-            # Create manifest
-            manifest = {
-                'database_name': db_name,
-                'backup_date': datetime.datetime.now().isoformat(),
-                'database_file': os.path.basename(db_file),
-                'filestore_file': os.path.basename(fs_file) if fs_file else None,
-                'backup_size_mb': round(os.path.getsize(db_file) / (1024*1024), 2)
-            }
+            dump = stages.submit('dumps', self.dump_database, db_name, backup_dir, timestamp)
+            filestore = stages.submit('archives', self.archive_filestore, db_name, backup_dir, timestamp)
 
-            manifest_file = f"{backup_dir}/{db_name}_manifest_{timestamp}.json"
-            with open(manifest_file, 'w') as f:
-                json.dump(manifest, f, indent=2)
+            try:
+                dump_info = dump.result()
+            except Exception:
+                self.discard_artifact(filestore.result())
+                raise
+            db_file = dump_info['database_file']
+            fs_file = filestore.result()
+            if dump_info['error'] is not None:
+                self.logger.error(f"Database backup failed: {dump_info['error']}")
+                for partial in (db_file, fs_file):
+                    self.discard_artifact(partial)
+                return {'status': 'failed', 'error': dump_info['error']}
+
+            manifest_file = self.write_manifest(db_name, backup_dir, timestamp, db_file, fs_file, dump_info)
+            with open(manifest_file) as f:
+                self.catalog(backup_dir).add(manifest_file, json.load(f), db_file, fs_file)
 
             self.logger.info(f"Backup completed successfully for {db_name}")
             return {
@@ -100,13 +784,448 @@ class OdooBackupManager:
         except Exception as e:
             self.logger.error(f"Backup failed with exception: {str(e)}")
             return {'status': 'failed', 'error': str(e)}
+        finally:
+            if own_stages:
+                stages.shutdown()
+
+    def _pg_env(self) -> Dict[str, str]:
+        # Set password environment variable
+        env = os.environ.copy()
+        env['PGPASSWORD'] = self.config.get('database', 'password')
+        return env
+
+    def _pg_connection_args(self) -> List[str]:
+        return [
+            '-h', self.config.get('database', 'host', fallback='localhost'),
+            '-p', self.config.get('database', 'port', fallback='5432'),
+            '-U', self.config.get('database', 'user', fallback='odoo'),
+        ]
+
+    def database_size(self, db_name: str) -> Optional[int]:
+        """Size of a database in bytes, or None if it cannot be queried"""
+        cmd = ['psql'] + self._pg_connection_args() + [
+            '-X', '-A', '-t', '-d', db_name, '-c', 'SELECT pg_database_size(current_database())']
+        try:
+            result = subprocess.run(cmd, env=self._pg_env(), capture_output=True, text=True, timeout=60)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            self.logger.warning(f"Could not query size of {db_name}: {e}")
+            return None
+        if result.returncode != 0 or not result.stdout.strip().isdigit():
+            self.logger.warning(f"Could not query size of {db_name}: {result.stderr.strip()}")
+            return None
+        return int(result.stdout.strip())
+
+    def pg_dump_major_version(self) -> int:
+        """Major version of the local pg_dump (0 if unknown)"""
+        with self._init_lock:
+            if self._pg_dump_major is None:
+                try:
+                    output = subprocess.run(['pg_dump', '--version'], capture_output=True, text=True).stdout
+                    match = re.search(r'(\d+)(?:\.\d+)?', output)
+                    self._pg_dump_major = int(match.group(1)) if match else 0
+                except OSError:
+                    self._pg_dump_major = 0
+            return self._pg_dump_major
+
+    def compression_option(self) -> Optional[str]:
+        """pg_dump --compress value for the [dump] compression setting.
+
+        Accepts a gzip level ("9"), "none" or "method[:level]" with method
+        gzip, lz4 or zstd. Methods other than gzip need pg_dump 16+; older
+        versions fall back to their default gzip compression.
+        """
+        spec = self.config.get('dump', 'compression', fallback='9').strip().lower()
+        if self.pg_dump_major_version() >= 16:
+            return spec
+        method, _, level = spec.partition(':')
+        if spec.isdigit():
+            return spec
+        if method == 'none':
+            return '0'
+        if method == 'gzip':
+            return level or None
+        self.logger.warning(f"pg_dump {self.pg_dump_major_version()} does not support {method} compression; "
+                            f"using gzip")
+        return None
+
+    def dump_settings(self, db_name: str) -> Dict:
+        """Choose format, parallel jobs and compression for one database's dump"""
+        dump_format = self.config.get('dump', 'format', fallback='auto')
+        size = None
+        if dump_format == 'auto':
+            size = self.database_size(db_name)
+            threshold = self.config.getfloat('dump', 'directory_threshold_gb',
+                                             fallback=DIRECTORY_FORMAT_THRESHOLD_GB) * 1024 ** 3
+            dump_format = 'directory' if size is not None and size >= threshold else 'custom'
+        if dump_format not in ('custom', 'directory'):
+            raise ValueError(f"Unsupported dump format: {dump_format}")
+        jobs = self.config.getint('dump', 'jobs', fallback=4) if dump_format == 'directory' else 1
+        return {'format': dump_format, 'jobs': jobs, 'compression': self.compression_option(),
+                'database_size': size}
+
+    def dump_database(self, db_name: str, backup_dir: str, timestamp: str) -> Dict:
+        """Run pg_dump for one database.
+
+        Large databases use the directory format with `--jobs`, which
+        dumps tables in parallel; the rest use a single custom-format file.
+        Returns the dump settings with 'database_file' and 'error' (None on
+        success).
+        """
+        settings = self.dump_settings(db_name)
+        pipeline = self.pipeline_settings()
+        if pipeline:
+            if settings['format'] == 'directory':
+                self.logger.warning(f"Directory-format dumps cannot be streamed; dumping {db_name} as custom")
+                settings['format'], settings['jobs'] = 'custom', 1
+            name = f"{db_name}_db_{timestamp}.dump"
+            if pipeline['compressor'] == 'gzip':
+                settings['compression'] = '0'  # the pipeline compresses instead of pg_dump
+                name += '.gz'
+            if pipeline['recipient']:
+                name += '.gpg'
+            settings['database_file'] = self.pipeline_location(backup_dir, name, pipeline)
+            run_dump = lambda: self._pipeline_pg_dump(db_name, backup_dir, name, settings, pipeline)
+        else:
+            suffix = 'dir' if settings['format'] == 'directory' else 'dump'
+            db_file = f"{backup_dir}/{db_name}_db_{timestamp}.{suffix}"
+            settings['database_file'] = db_file
+            run_dump = lambda: self._run_pg_dump(db_name, db_file, settings)
+
+        result = run_dump()
+        compression = settings['compression'] or ''
+        if (result.returncode != 0 and 'does not support compression' in result.stderr
+                and not compression.startswith('gzip') and not compression.isdigit()):
+            # This pg_dump build lacks lz4/zstd support
+            self.logger.warning(f"pg_dump cannot use {compression} compression, retrying with gzip")
+            _remove_path(settings['database_file'])
+            settings['compression'] = None
+            result = run_dump()
+
+        settings['error'] = result.stderr if result.returncode != 0 else None
+        return settings
+
+    def _pg_dump_command(self, db_name: str, db_file: Optional[str], settings: Dict) -> List[str]:
+        db_cmd = ['pg_dump'] + self._pg_connection_args() + [
+            f"--format={settings['format']}",
+            '--verbose',
+        ]
+        if db_file is not None:
+            db_cmd.append(f'--file={db_file}')
+        if settings['compression'] is not None:
+            db_cmd.append(f"--compress={settings['compression']}")
+        if settings['format'] == 'directory':
+            db_cmd.append(f"--jobs={settings['jobs']}")
+        db_cmd.append(db_name)
+        self.logger.info(f"Dumping {db_name} as {settings['format']} "
+                         f"(jobs={settings['jobs']}, compression={settings['compression'] or 'default'})")
+        return db_cmd
+
+    def _run_pg_dump(self, db_name: str, db_file: str, settings: Dict) -> subprocess.CompletedProcess:
+        db_cmd = self._pg_dump_command(db_name, db_file, settings)
+        return subprocess.run(db_cmd, env=self._pg_env(), capture_output=True, text=True)
+
+    def _pipeline_pg_dump(self, db_name: str, backup_dir: str, name: str, settings: Dict,
+                          pipeline: Dict) -> subprocess.CompletedProcess:
+        """Stream pg_dump's stdout through the pipeline, without an intermediate file"""
+        db_cmd = self._pg_dump_command(db_name, None, settings)
+        try:
+            sink = self.open_pipeline(backup_dir, name, pipeline)
+        except (OSError, ImportError) as e:
+            return subprocess.CompletedProcess(db_cmd, 1, None, f"Cannot open {name}: {e}")
+        out = sink
+        if pipeline['compressor'] == 'gzip':
+            out = ParallelGzipWriter(sink, workers=pipeline['workers'], level=pipeline['level'])
+
+        try:
+            process = subprocess.Popen(db_cmd, env=self._pg_env(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            if out is not sink:
+                out.abort()
+            sink.abort()
+            return subprocess.CompletedProcess(db_cmd, 1, None, f"Cannot run pg_dump: {e}")
+        # Drain the --verbose log concurrently so pg_dump never blocks on a full stderr pipe
+        stderr = []
+        reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+        reader.start()
+        try:
+            for chunk in iter(lambda: process.stdout.read(PIPELINE_CHUNK_SIZE), b''):
+                out.write(chunk)
+            if process.wait() == 0:
+                if out is not sink:
+                    out.finish()
+                sink.close()
+                settings['size'] = sink.size
+        except Exception as e:
+            process.kill()
+            process.wait()
+            reader.join()
+            if out is not sink:
+                out.abort()
+            sink.abort()
+            return subprocess.CompletedProcess(db_cmd, 1, None, f"Streaming {name} failed: {e}")
+        reader.join()
+        if process.returncode != 0:
+            if out is not sink:
+                out.abort()
+            sink.abort()
+        else:
+            self.logger.info(f"Streamed {settings['size'] / (1024*1024):.1f} MB dump of {db_name} "
+                             f"to {settings['database_file']}")
+        return subprocess.CompletedProcess(db_cmd, process.returncode, None,
+                                           b''.join(stderr).decode(errors='replace'))
+
+    def archive_filestore(self, db_name: str, backup_dir: str, timestamp: str) -> Optional[str]:
+        """Archive the database's filestore; returns the archive path, or None if absent or failed.
+
+        The built-in archiver (default) compresses on a thread pool and skips
+        recompressing attachments that are already compressed; set
+        [filestore] archiver = tar to shell out to `tar -czf` instead.
+        """
+        filestore_path = Path(self.config.get('odoo', 'filestore_path', fallback='/var/lib/odoo/filestore')) / db_name
+        if not filestore_path.exists():
+            return None
+
+        if self.config.get('filestore', 'mode', fallback='full') == 'incremental':
+            return self.snapshot_filestore(db_name, str(filestore_path), backup_dir, timestamp)
+
+        archiver = FilestoreArchiver(
+            workers=self.config.getint('filestore', 'workers', fallback=0) or None,
+            level=self.config.getint('filestore', 'compression_level', fallback=6),
+            block_size=self.config.getint('filestore', 'block_size_kb', fallback=1024) * 1024)
+        pipeline = self.pipeline_settings()
+        if pipeline and pipeline['filestore']:
+            name = f"{db_name}_filestore_{timestamp}.tar.gz" + ('.gpg' if pipeline['recipient'] else '')
+            try:
+                sink = self.open_pipeline(backup_dir, name, pipeline)
+                try:
+                    stats = archiver.archive_to(str(filestore_path), db_name, sink)
+                    sink.close()
+                except BaseException:
+                    sink.abort()
+                    raise
+            except (OSError, ImportError) as e:
+                self.logger.warning(f"Filestore backup failed: {e}")
+                return None
+            fs_file = self.pipeline_location(backup_dir, name, pipeline)
+            self.logger.info(f"Streamed filestore of {db_name} to {fs_file}: {stats['files']} files, "
+                             f"{stats['bytes_in'] / (1024*1024):.1f} MB in, "
+                             f"{sink.size / (1024*1024):.1f} MB written")
+            self._warn_changed_files(db_name, stats)
+            return fs_file
+
+        fs_file = f"{backup_dir}/{db_name}_filestore_{timestamp}.tar.gz"
+        if self.config.get('filestore', 'archiver', fallback='builtin') == 'tar':
+            tar_cmd = ['tar', '-czf', fs_file, '-C', str(filestore_path.parent), db_name]
+
+            fs_result = subprocess.run(tar_cmd, capture_output=True, text=True)
+            if fs_result.returncode != 0:
+                self.logger.warning(f"Filestore backup failed: {fs_result.stderr}")
+                return None
+            return fs_file
+
+        try:
+            stats = archiver.archive(str(filestore_path), db_name, fs_file)
+        except OSError as e:
+            self.logger.warning(f"Filestore backup failed: {e}")
+            return None
+        self.logger.info(f"Archived filestore of {db_name}: {stats['files']} files, "
+                         f"{stats['bytes_in'] / (1024*1024):.1f} MB in, "
+                         f"{stats['bytes_stored'] / (1024*1024):.1f} MB stored without recompression, "
+                         f"{stats['bytes_out'] / (1024*1024):.1f} MB written")
+        self._warn_changed_files(db_name, stats)
+        return fs_file
+
+    def _warn_changed_files(self, db_name: str, stats: Dict[str, int]):
+        if stats['files_changed']:
+            self.logger.warning(f"{stats['files_changed']} filestore files of {db_name} changed while being "
+                                f"archived; their archived copies may be incomplete")
+
+    def blob_store(self, backup_dir: str) -> str:
+        """Directory of the content-addressed blob store used by incremental filestore backups"""
+        return self.config.get('filestore', 'blob_dir', fallback=os.path.join(backup_dir, 'filestore_blobs'))
+
+    def blob_index(self, backup_dir: str) -> BlobIndex:
+        with self._init_lock:
+            if self._blob_index is None:
+                store = self.blob_store(backup_dir)
+                os.makedirs(store, exist_ok=True)
+                self._blob_index = BlobIndex(os.path.join(store, 'index.sqlite'))
+            return self._blob_index
+
+    def snapshot_filestore(self, db_name: str, filestore_path: str, backup_dir: str, timestamp: str) -> Optional[str]:
+        """Incremental filestore backup; returns the snapshot manifest path, or None if failed.
+
+        Attachments are immutable and named after their SHA-1, so only blobs
+        missing from the index are added to the blob store (hard-linked when
+        it is on the same filesystem, copied otherwise). The snapshot lists
+        every file of the filestore with the blob it needs.
+        """
+        index = self.blob_index(backup_dir)
+        store = self.blob_store(backup_dir)
+        snapshot = {'database_name': db_name,
+                    'snapshot_date': datetime.datetime.now().isoformat(),
+                    'blob_store': store,
+                    'file_count': 0, 'total_size': 0, 'new_blobs': 0, 'new_bytes': 0,
+                    'files': {}}
+        try:
+            for root, dirs, files in os.walk(filestore_path, onerror=_raise):
+                dirs.sort()
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    if not os.path.isfile(path):
+                        continue  # dangling symlink
+                    size = os.path.getsize(path)
+                    if BLOB_NAME.match(name) and os.path.basename(root) == name[:2]:
+                        sha1 = name
+                    else:
+                        sha1 = _file_sha1(path)  # not an attachment blob, e.g. a checklist file
+                    if not index.known(sha1):
+                        self._store_blob(path, os.path.join(store, sha1[:2], sha1))
+                        index.add(sha1, size)
+                        snapshot['new_blobs'] += 1
+                        snapshot['new_bytes'] += size
+                    snapshot['files'][os.path.relpath(path, filestore_path)] = sha1
+                    snapshot['file_count'] += 1
+                    snapshot['total_size'] += size
+        except OSError as e:
+            self.logger.warning(f"Filestore snapshot failed: {e}")
+            return None
+        finally:
+            index.commit()  # blobs already in the store stay indexed even if the snapshot failed
+
+        snapshot_file = f"{backup_dir}/{db_name}_filestore_{timestamp}.json"
+        with open(snapshot_file, 'w') as f:
+            json.dump(snapshot, f, indent=2)
+        self.logger.info(f"Filestore snapshot of {db_name}: {snapshot['file_count']} files, "
+                         f"{snapshot['new_blobs']} new blobs "
+                         f"({snapshot['new_bytes'] / (1024*1024):.1f} MB of "
+                         f"{snapshot['total_size'] / (1024*1024):.1f} MB)")
+        return snapshot_file
+
+    @staticmethod
+    def _store_blob(source: str, blob_path: str):
+        if os.path.exists(blob_path):
+            return
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        partial_path = f"{blob_path}.part.{threading.get_ident()}"
+        try:
+            os.link(source, partial_path)
+        except OSError:
+            shutil.copy2(source, partial_path)
+        os.replace(partial_path, blob_path)
+
+    def upload_blobs(self, snapshot_file: str, backup_dir: str, bucket: str, stages: StageExecutor):
+        """Upload the blobs of a snapshot that are not in S3 yet, as odoo-backups/blobs/<sha1>"""
+        with open(snapshot_file) as f:
+            snapshot = json.load(f)
+        index = self.blob_index(backup_dir)
+        store = snapshot['blob_store']
+        claims = index.claim_uploads(set(snapshot['files'].values()))
+        uploads = [(sha1, stages.submit('uploads', self.upload_to_s3, os.path.join(store, sha1[:2], sha1),
+                                        bucket, f"odoo-backups/blobs/{sha1[:2]}/{sha1}"))
+                   for sha1 in claims]
+        for sha1, upload in uploads:
+            index.finish_upload(sha1, upload.result())
+        if claims:
+            self.logger.info(f"Uploaded {len(claims)} new filestore blobs of {snapshot['database_name']}")
+
+    def write_manifest(self, db_name: str, backup_dir: str, timestamp: str,
+                       db_file: str, fs_file: Optional[str], dump_info: Optional[Dict] = None) -> str:
+        """Write the JSON manifest describing one backup; returns its path"""
+        dump_info = dump_info or {}
+        manifest = {
+            'database_name': db_name,
+            'backup_date': datetime.datetime.now().isoformat(),
+            'database_file': os.path.basename(db_file),
+            'database_format': dump_info.get('format', 'custom'),
+            'pg_dump_jobs': dump_info.get('jobs', 1),
+            'compression': dump_info.get('compression') or 'default',
+            'filestore_file': os.path.basename(fs_file) if fs_file else None,
+            'filestore_mode': 'incremental' if fs_file and fs_file.endswith('.json') else 'full',
+            'backup_size_mb': round((dump_info.get('size') or _path_size(db_file)) / (1024*1024), 2)
+        }
+
+        manifest_file = f"{backup_dir}/{db_name}_manifest_{timestamp}.json"
+        with open(manifest_file, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest_file
+
+    def pipeline_settings(self) -> Optional[Dict]:
+        """Options of the streaming pipeline, or None when backups are written to disk first.
+
+        [s3] stream_dumps = true is shorthand for streaming just the dump to S3.
+        """
+        if self.config.getboolean('pipeline', 'enabled', fallback=False):
+            sink = self.config.get('pipeline', 'sink', fallback='file')
+            compressor = self.config.get('pipeline', 'compressor', fallback='gzip')
+            if sink not in ('file', 's3', 'both'):
+                raise ValueError(f"Unsupported pipeline sink: {sink}")
+            if compressor not in ('gzip', 'none'):
+                raise ValueError(f"Unsupported pipeline compressor: {compressor}")
+            if sink != 'file' and not self.config.has_section('s3'):
+                raise ValueError(f"Pipeline sink {sink} needs an [s3] section")
+            return {'sinks': ['file', 's3'] if sink == 'both' else [sink],
+                    'compressor': compressor,
+                    'level': self.config.getint('pipeline', 'compression_level', fallback=6),
+                    'workers': self.config.getint('pipeline', 'workers', fallback=0) or None,
+                    'recipient': self.config.get('pipeline', 'encrypt_recipient', fallback='') or None,
+                    'filestore': True}
+        if self.config.has_section('s3') and self.config.getboolean('s3', 'stream_dumps', fallback=False):
+            return {'sinks': ['s3'], 'compressor': 'none', 'recipient': None, 'filestore': False}
+        return None
+
+    def pipeline_location(self, backup_dir: str, name: str, pipeline: Dict) -> str:
+        """Where a streamed artifact ends up: its local path if written to disk, else its S3 URL"""
+        if 'file' in pipeline['sinks']:
+            return os.path.join(backup_dir, name)
+        return f"s3://{self.config.get('s3', 'bucket')}/odoo-backups/{name}"
+
+    def discard_artifact(self, location: Optional[str]):
+        """Delete an artifact of a failed backup, including the copy streamed to S3"""
+        if not location:
+            return
+        pipeline = self.pipeline_settings()
+        if location.startswith('s3://') or (pipeline and 's3' in pipeline['sinks']):
+            try:
+                self.s3_uploader().client.delete_object(Bucket=self.config.get('s3', 'bucket'),
+                                                        Key=f"odoo-backups/{os.path.basename(location)}")
+            except Exception as e:
+                self.logger.error(f"S3 cleanup of {location} failed: {str(e)}")
+        if not location.startswith('s3://'):
+            _remove_path(location)
+
+    def open_pipeline(self, backup_dir: str, name: str, pipeline: Dict):
+        """Sink chain for one streamed artifact: optional gpg, then a file and/or S3"""
+        sinks = []
+        try:
+            if 's3' in pipeline['sinks']:
+                sinks.append(S3Sink(self.s3_uploader(), self.config.get('s3', 'bucket'), f"odoo-backups/{name}"))
+            if 'file' in pipeline['sinks']:
+                sinks.append(FileSink(os.path.join(backup_dir, name)))
+            sink = sinks[0] if len(sinks) == 1 else TeeSink(sinks)
+            if pipeline['recipient']:
+                sink = GpgEncryptor(pipeline['recipient'], sink)
+        except BaseException:
+            for opened in sinks:
+                opened.abort()
+            raise
+        return sink
+
+    def s3_uploader(self) -> S3Uploader:
+        """The shared uploader for the [s3] section (raises ImportError without boto3)"""
+        with self._init_lock:
+            if self._s3_uploader is None:
+                self._s3_uploader = S3Uploader(
+                    region=self.config.get('s3', 'region', fallback=None),
+                    endpoint_url=self.config.get('s3', 'endpoint_url', fallback=None),
+                    part_size=self.config.getint('s3', 'part_size_mb', fallback=16) * 1024 * 1024,
+                    concurrency=self.config.getint('s3', 'concurrency', fallback=8))
+            return self._s3_uploader
 
     def upload_to_s3(self, file_path: str, s3_bucket: str, s3_key: str) -> bool:
         """Upload backup file to AWS S3"""
         try:
-            import boto3
-            s3_client = boto3.client('s3')
-            s3_client.upload_file(file_path, s3_bucket, s3_key)
+            self.s3_uploader().upload_file(file_path, s3_bucket, s3_key)
             self.logger.info(f"Uploaded {file_path} to s3://{s3_bucket}/{s3_key}")
             return True
         except ImportError:
@@ -116,48 +1235,254 @@ class OdooBackupManager:
             self.logger.error(f"S3 upload failed: {str(e)}")
             return False
 
-    def cleanup_old_backups(self, backup_dir: str, retention_days: int):
-        """Remove backup files older than retention_days"""
-        cutoff_date = datetime.datetime.now() - datetime.timedelta(days=retention_days)
+    def catalog(self, backup_dir: str) -> BackupCatalog:
+        """The backup catalog; a new catalog is filled from the manifests already on disk"""
+        with self._init_lock:
+            if self._catalog is None:
+                self._catalog = BackupCatalog(os.path.join(backup_dir, 'backup_catalog.sqlite'))
+                if self._catalog.created:
+                    self._import_manifests(backup_dir)
+            return self._catalog
+
+    def rebuild_catalog(self, backup_dir: str) -> int:
+        """Re-read every manifest in backup_dir into the catalog; returns the number imported"""
+        self.catalog(backup_dir)
+        with self._init_lock:
+            return self._import_manifests(backup_dir)
+
+    def _import_manifests(self, backup_dir: str) -> int:
+        imported = 0
+        for manifest_path in sorted(Path(backup_dir).glob('*_manifest_*.json')):
+            try:
+                with open(manifest_path) as f:
+                    manifest = json.load(f)
+                locations = [self._artifact_location(backup_dir, manifest.get(key))
+                             for key in ('database_file', 'filestore_file')]
+                self._catalog.add(str(manifest_path), manifest, *locations)
+                imported += 1
+            except (OSError, ValueError, KeyError) as e:
+                self.logger.warning(f"Skipping unreadable manifest {manifest_path}: {e}")
+        self.logger.info(f"Imported {imported} manifests into the backup catalog")
+        return imported
+
+    def _artifact_location(self, backup_dir: str, name: Optional[str]) -> Optional[str]:
+        """Local path of a manifest entry, or its S3 URL if it was only streamed there"""
+        if not name:
+            return None
+        local_path = os.path.join(backup_dir, name)
+        if not os.path.lexists(local_path) and self.config.has_section('s3'):
+            return f"s3://{self.config.get('s3', 'bucket')}/odoo-backups/{name}"
+        return local_path
+
+    def retention_policy(self, retention_days: Optional[int] = None) -> Dict[str, int]:
+        """GFS policy from the [retention] section; keep_days defaults to [backup] retention_days"""
+        policy = {key: self.config.getint('retention', key, fallback=default)
+                  for key, default in RETENTION_POLICY.items()}
+        if retention_days is not None and not self.config.has_option('retention', 'keep_days'):
+            policy['keep_days'] = retention_days
+        policy['min_good'] = max(1, policy['min_good'])
+        return policy
+
+    def cleanup_old_backups(self, backup_dir: str, retention_days: Optional[int] = None):
+        """Delete the catalogued backups that the retention policy no longer keeps.
 
-        for file_path in Path(backup_dir).glob('*'):
-            if file_path.stat().st_mtime < cutoff_date.timestamp():
-                file_path.unlink()
-                self.logger.info(f"Removed old backup: {file_path}")
+        The keep/delete decision is made in memory from the catalog, so
+        the backup directory is never listed, and files that are not part
+        of a catalogued backup are left alone. S3 deletes and catalog
+        updates are batched.
+        """
+        catalog = self.catalog(backup_dir)
+        policy = self.retention_policy(retention_days)
+        self.logger.info("Retention policy: " + ", ".join(f"{key}={value}" for key, value in policy.items()))
+        expired = plan_retention(catalog.backups(), policy, datetime.datetime.now())
+        if not expired:
+            return
 
-    def run_backup(self, databases: List[str]):
-        """Run backup for multiple databases"""
+        s3_keys = {}
+        for backup in expired:
+            for location in (backup['database_file'], backup['filestore_file'], backup['manifest_file']):
+                if not location:
+                    continue
+                if location.startswith('s3://'):
+                    bucket, _, key = location[len('s3://'):].partition('/')
+                    s3_keys.setdefault(bucket, []).append(key)
+                else:
+                    _remove_path(location)
+            self.logger.debug(f"Removed old backup: {backup['manifest_file']}")
+
+        try:
+            for bucket, keys in s3_keys.items():
+                for i in range(0, len(keys), S3_DELETE_BATCH):
+                    batch = [{'Key': key} for key in keys[i:i + S3_DELETE_BATCH]]
+                    self.s3_uploader().client.delete_objects(Bucket=bucket, Delete={'Objects': batch, 'Quiet': True})
+        except Exception as e:
+            self.logger.error(f"S3 cleanup failed: {str(e)}")
+            return  # keep the catalog rows so the next run retries
+
+        catalog.remove([backup['manifest_file'] for backup in expired])
+        self.logger.info(f"Removed {len(expired)} old backups "
+                         f"({sum(len(keys) for keys in s3_keys.values())} S3 objects)")
+        if any((backup['filestore_file'] or '').endswith('.json') for backup in expired):
+            self.collect_blobs(backup_dir)
+
+    def collect_blobs(self, backup_dir: str):
+        """Delete the blobs that no catalogued filestore snapshot references any more.
+
+        Skipped while another run shares the blob store: its snapshot may use
+        blobs before it reaches the catalog.
+        """
+        index = self.blob_index(backup_dir)
+        if not index.lock_exclusive():
+            self.logger.info("Another backup run is using the blob store, skipping blob garbage collection")
+            return
+        try:
+            self._collect_blobs(backup_dir, index)
+        finally:
+            index.unlock_exclusive()
+
+    def _collect_blobs(self, backup_dir: str, index: BlobIndex):
+        snapshots = [backup['filestore_file'] for backup in self.catalog(backup_dir).backups()
+                     if (backup['filestore_file'] or '').endswith('.json')]
+        try:
+            garbage = index.unreferenced(snapshots)
+        except (OSError, ValueError, KeyError) as e:
+            # A snapshot we cannot read may still need any blob
+            self.logger.warning(f"Skipping blob garbage collection: {e}")
+            return
+        if not garbage:
+            return
+
+        s3_keys = [f"odoo-backups/blobs/{sha1[:2]}/{sha1}" for sha1, uploaded in garbage if uploaded]
+        try:
+            for i in range(0, len(s3_keys), S3_DELETE_BATCH):
+                batch = [{'Key': key} for key in s3_keys[i:i + S3_DELETE_BATCH]]
+                self.s3_uploader().client.delete_objects(Bucket=self.config.get('s3', 'bucket'),
+                                                         Delete={'Objects': batch, 'Quiet': True})
+        except Exception as e:
+            self.logger.error(f"S3 blob cleanup failed: {str(e)}")
+            return  # keep the index rows so the next run retries
+
+        store = self.blob_store(backup_dir)
+        for sha1, _ in garbage:
+            _remove_path(os.path.join(store, sha1[:2], sha1))
+        index.remove([sha1 for sha1, _ in garbage])
+        self.logger.info(f"Removed {len(garbage)} unreferenced filestore blobs ({len(s3_keys)} from S3)")
+
+    def stage_limits(self) -> Dict[str, int]:
+        """Per-stage concurrency from the [concurrency] config section"""
+        return {stage: self.config.getint('concurrency', stage, fallback=default)
+                for stage, default in STAGE_LIMITS.items()}
+
+    def run_backup(self, databases: List[str], limits: Optional[Dict[str, int]] = None):
+        """Run backup for multiple databases with concurrent, bounded stages"""
         backup_dir = self.config.get('backup', 'directory', fallback='/backup/odoo')
         Path(backup_dir).mkdir(parents=True, exist_ok=True)
+        self.catalog(backup_dir)
 
-        results = {}
-        for db_name in databases:
-            results[db_name] = self.backup_database(db_name, backup_dir)
-
-            # Upload to S3 if configured
-            if self.config.has_section('s3') and results[db_name]['status'] == 'success':
-                s3_bucket = self.config.get('s3', 'bucket')
-                for file_type in ['database_file', 'filestore_file', 'manifest_file']:
-                    file_path = results[db_name].get(file_type)
-                    if file_path and os.path.exists(file_path):
-                        s3_key = f"odoo-backups/{os.path.basename(file_path)}"
-                        self.upload_to_s3(file_path, s3_bucket, s3_key)
+        stages = StageExecutor(limits or self.stage_limits())
+        try:
+            # One lightweight coordinator per database; the stage pools do the work
+            with ThreadPoolExecutor(max_workers=max(1, len(databases))) as coordinators:
+                futures = {db_name: coordinators.submit(self._backup_and_upload, db_name, backup_dir, stages)
+                           for db_name in databases}
+                results = {db_name: future.result() for db_name, future in futures.items()}
+        finally:
+            stages.shutdown()
 
         # Cleanup old backups
-        retention_days = int(self.config.get('backup', 'retention_days', fallback='30'))
-        self.cleanup_old_backups(backup_dir, retention_days)
+        try:
+            retention_days = int(self.config.get('backup', 'retention_days', fallback='30'))
+            self.cleanup_old_backups(backup_dir, retention_days)
+        finally:
+            if self._s3_uploader is not None:
+                self._s3_uploader.shutdown()
+                self._s3_uploader = None
 
         return results
 
+    def _backup_and_upload(self, db_name: str, backup_dir: str, stages: StageExecutor) -> Dict[str, str]:
+        result = self.backup_database(db_name, backup_dir, stages)
+
+        # Upload to S3 if configured
+        if self.config.has_section('s3') and result['status'] == 'success':
+            s3_bucket = self.config.get('s3', 'bucket')
+            # Artifacts the pipeline already streamed to S3 are not uploaded again
+            pipeline = self.pipeline_settings()
+            streamed = set()
+            if pipeline and 's3' in pipeline['sinks']:
+                streamed.add('database_file')
+                if pipeline['filestore'] and self.config.get('filestore', 'mode', fallback='full') != 'incremental':
+                    streamed.add('filestore_file')
+            uploads = []
+            for file_type in ['database_file', 'filestore_file', 'manifest_file']:
+                file_path = result.get(file_type)
+                if file_type in streamed or not file_path or not os.path.exists(file_path):
+                    continue
+                if os.path.isdir(file_path):
+                    # Directory-format dumps upload file by file under their directory name
+                    targets = [(os.path.join(file_path, name), f"{os.path.basename(file_path)}/{name}")
+                               for name in sorted(os.listdir(file_path))]
+                else:
+                    targets = [(file_path, os.path.basename(file_path))]
+                for local_path, name in targets:
+                    uploads.append(stages.submit('uploads', self.upload_to_s3, local_path, s3_bucket,
+                                                 f"odoo-backups/{name}"))
+            for upload in uploads:
+                upload.result()
+            fs_file = result.get('filestore_file')
+            if fs_file and fs_file.endswith('.json'):
+                self.upload_blobs(fs_file, backup_dir, s3_bucket, stages)
+
+        return result
+
+def _path_size(path: str) -> int:
+    """Size of a file, or the total size of a directory-format dump"""
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    return os.path.getsize(path)
+
+def _raise(error: OSError):
+    """os.walk error handler: fail instead of silently skipping unreadable directories"""
+    raise error
+
+def _file_sha1(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _remove_path(path: Optional[str]):
+    if not path or not os.path.lexists(path):
+        return
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
 def main():
     parser = argparse.ArgumentParser(description='Backup Odoo databases')
     parser.add_argument('databases', nargs='+', help='Database names to backup')
     parser.add_argument('--config', default='backup_config.ini', help='Configuration file')
+    parser.add_argument('--dump-jobs', type=int, help='Concurrent pg_dump runs (default: [concurrency] dumps)')
+    parser.add_argument('--archive-jobs', type=int,
+                        help='Concurrent filestore archives (default: [concurrency] archives)')
+    parser.add_argument('--upload-jobs', type=int, help='Concurrent uploads (default: [concurrency] uploads)')
+    parser.add_argument('--rebuild-catalog', action='store_true',
+                        help='Re-import all manifests into the backup catalog before backing up')
 
     args = parser.parse_args()
 
     backup_manager = OdooBackupManager(args.config)
-    results = backup_manager.run_backup(args.databases)
+    if args.rebuild_catalog:
+        backup_dir = backup_manager.config.get('backup', 'directory', fallback='/backup/odoo')
+        Path(backup_dir).mkdir(parents=True, exist_ok=True)
+        print(f"📚 Imported {backup_manager.rebuild_catalog(backup_dir)} manifests into the catalog")
+    limits = backup_manager.stage_limits()
+    for stage, value in (('dumps', args.dump_jobs), ('archives', args.archive_jobs), ('uploads', args.upload_jobs)):
+        if value:
+            limits[stage] = value
+    results = backup_manager.run_backup(args.databases, limits)
 
     # Print summary
     for db_name, result in results.items():